@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Measure LocalDictionary.define() latency against dictionary databases of
+different sizes, comparing the old flat `dictionary` table with the indexed
+schema.
+
+Usage: python benchmarks/bench_dictdb.py [rows ...]
+(default: 10000 1000000 5000000)
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ssmtool.db import LocalDictionary
+
+LOOKUPS = 200
+DICTS = 4
+
+
+def rows(n):
+    "n entries spread over a few dictionaries, like a real dict.db"
+    for i in range(n):
+        yield (f"word{i}", f"definition of word {i}", "en", f"dict{i % DICTS}")
+
+
+def build_legacy(dbpath, n):
+    conn = sqlite3.connect(dbpath)
+    conn.execute("""
+    CREATE TABLE dictionary (
+        word TEXT,
+        definition TEXT,
+        language TEXT,
+        dictname TEXT
+    )
+    """)
+    conn.executemany("INSERT INTO dictionary VALUES(?, ?, ?, ?)", rows(n))
+    conn.commit()
+    conn.close()
+
+
+def legacy_define(conn, word, lang, name):
+    return conn.execute("""
+    SELECT definition FROM dictionary
+    WHERE word=?
+    AND language=?
+    AND dictname=?
+    """, (word, lang, name)).fetchone()[0]
+
+
+def timeit(fn, queries):
+    start = time.perf_counter()
+    for word, name in queries:
+        fn(word, "en", name)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def bench(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        dbpath = os.path.join(tmp, "dict.db")
+        build_legacy(dbpath, n)
+        queries = [(f"word{i}", f"dict{i % DICTS}")
+                   for i in random.sample(range(n), min(LOOKUPS, n))]
+
+        conn = sqlite3.connect(dbpath)
+        before = timeit(lambda *args: legacy_define(conn, *args), queries)
+        conn.close()
+
+        start = time.perf_counter()
+        dictdb = LocalDictionary(dbpath)
+        migration = time.perf_counter() - start
+        after = timeit(dictdb.define, queries)
+        print(f"{n:>10} rows | before {before:9.3f} ms | after {after:7.3f} ms"
+              f" | migration {migration:6.1f} s")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 1_000_000, 5_000_000]
+    for n in sizes:
+        bench(n)
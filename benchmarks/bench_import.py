@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Measure dictionary import throughput (entries/second) for every supported
+dictionary format, using generated files of the given size.
+
+Usage: python benchmarks/bench_import.py [entries]  (default: 300000)
+"""
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ssmtool.db import LocalDictionary
+from ssmtool.tools import dict_readers
+
+
+def write_json(tmp, n):
+    fname = os.path.join(tmp, "dict.json")
+    with open(fname, "w", encoding="utf-8") as f:
+        json.dump({f"word{i}": f"definition of word {i}" for i in range(n)}, f)
+    return fname
+
+
+def write_migaku(tmp, n):
+    fname = os.path.join(tmp, "migaku.json")
+    with open(fname, "w", encoding="utf-8") as f:
+        json.dump([{"term": f"word{i}", "definition": f"definition of word {i}"}
+                   for i in range(n)], f)
+    return fname
+
+
+def write_freq(tmp, n):
+    fname = os.path.join(tmp, "freq.json")
+    with open(fname, "w", encoding="utf-8") as f:
+        json.dump([f"word{i}" for i in range(n)], f)
+    return fname
+
+
+def write_stardict(tmp, n):
+    base = os.path.join(tmp, "stardict")
+    words = sorted(f"word{i}" for i in range(n))
+    idx = bytearray()
+    offset = 0
+    with open(base + ".dict", "wb") as d:
+        for word in words:
+            data = f"<b>definition</b> of {word}".encode("utf-8")
+            d.write(data)
+            idx += word.encode("utf-8") + b"\0" + struct.pack(">II", offset, len(data))
+            offset += len(data)
+    with open(base + ".idx", "wb") as f:
+        f.write(idx)
+    with open(base + ".ifo", "w", encoding="utf-8") as f:
+        f.write("StarDict's dict ifo file\nversion=2.4.2\n"
+                f"wordcount={n}\nidxfilesize={len(idx)}\n"
+                "bookname=bench\nsametypesequence=h\n")
+    return base + ".ifo"
+
+
+writers = {
+    "stardict": write_stardict,
+    "json": write_json,
+    "migaku": write_migaku,
+    "freq": write_freq,
+}
+
+
+def bench(n):
+    for dicttype, writer in writers.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = writer(tmp, n)
+            dictdb = LocalDictionary(os.path.join(tmp, "dict.db"))
+            start = time.perf_counter()
+            count = dictdb.importdict(dict_readers[dicttype](fname), "en", dicttype)
+            elapsed = time.perf_counter() - start
+            print(f"{dicttype:>9} | {count:>8} entries | {elapsed:7.2f} s"
+                  f" | {count / elapsed:10.0f} entries/s")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 300_000)
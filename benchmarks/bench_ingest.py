@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measure book ingestion throughput of the web reader on a generated corpus
+of EPUB and FB2 files (half of the FB2 files in windows-1251), parsing
+each book in this process and with a process pool as the ingest jobs do.
+
+Usage: python benchmarks/bench_ingest.py [books] [chapters]  (default: 8 books of 60 chapters)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# The reader creates its database when imported
+tmp = tempfile.mkdtemp()
+os.environ["XDG_DATA_HOME"] = tmp
+from ebooklib import epub
+from ssmtool.ext.reader.utils import parseBook
+
+WORDS = ("the house was quiet and the river ran past the old mill where "
+         "nobody had worked for years but every morning a light burned").split()
+
+
+def paragraphs(n):
+    return [" ".join(random.choices(WORDS, k=80)).capitalize() + "." for _ in range(n)]
+
+
+def write_epub(path, chapters):
+    book = epub.EpubBook()
+    book.set_title("Generated")
+    book.add_author("Benchmark")
+    book.set_language("en")
+    items = []
+    for i in range(chapters):
+        chapter = epub.EpubHtml(title=f"Chapter {i}", file_name=f"ch{i}.xhtml", lang="en")
+        chapter.content = f"<h1>Chapter {i}</h1>" + "".join(f"<p>{p}</p>" for p in paragraphs(40))
+        book.add_item(chapter)
+        items.append(chapter)
+    book.toc = items
+    book.spine = items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    epub.write_epub(path, book)
+
+
+def write_fb2(path, chapters, encoding):
+    sections = "".join(
+        f"<section><title><p>Глава {i}</p></title>" + "".join(f"<p>{p}</p>" for p in paragraphs(40)) + "</section>"
+        for i in range(chapters))
+    xml = (f'<?xml version="1.0" encoding="{encoding}"?>'
+           '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0">'
+           '<description><title-info><author><first-name>Benchmark</first-name></author>'
+           '<book-title>Generated</book-title></title-info></description>'
+           f'<body>{sections}</body></FictionBook>')
+    with open(path, "wb") as f:
+        f.write(xml.encode(encoding))
+
+
+def run(name, paths, pool=None):
+    size = sum(os.path.getsize(path) for path in paths)
+    start = time.perf_counter()
+    chapters = sum(len(parseBook(path, pool)["chapters"]) for path in paths)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>20}: {len(paths) / elapsed:6.2f} books/s, {chapters / elapsed:8.1f} chapters/s,"
+          f" {size / elapsed / 1e6:6.2f} MB/s")
+
+
+def main(books, chapters):
+    epubs, fb2s = [], []
+    for i in range(books):
+        epubs.append(os.path.join(tmp, f"book{i}.epub"))
+        write_epub(epubs[-1], chapters)
+        fb2s.append(os.path.join(tmp, f"book{i}.fb2"))
+        write_fb2(fb2s[-1], chapters, "windows-1251" if i % 2 else "utf-8")
+    run("epub, serial", epubs)
+    run("fb2, serial", fb2s)
+    with ProcessPoolExecutor() as pool:
+        # Start the workers before timing
+        list(pool.map(abs, range(os.cpu_count() or 1)))
+        run("epub, process pool", epubs, pool)
+        run("fb2, process pool", fb2s, pool)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [8, 60][len(args):]))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Measure how many lookups per second Record.recordLookup can take with one
+commit per lookup versus write-behind batching, and how long the final
+flush takes.
+
+Usage: python benchmarks/bench_records.py [lookups]
+(default: 5000)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ssmtool.db import Record
+
+
+def bench(n, write_behind):
+    with tempfile.TemporaryDirectory() as tmp:
+        rec = Record(os.path.join(tmp, "records.db"), write_behind=write_behind)
+        words = [f"word{random.randrange(n // 5 + 1)}" for _ in range(n)]
+        start = time.perf_counter()
+        for word in words:
+            rec.recordLookup(word, "definition", "English", True, "wikt-en", True)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        rec.close()
+        close = time.perf_counter() - start
+        assert rec.db.queryone("SELECT COUNT(*) FROM lookups")[0] == n
+        label = "write-behind" if write_behind else "immediate"
+        print(f"{label:>12} | {n / elapsed:10.0f} lookups/s | close {close * 1000:7.1f} ms"
+              f" | today {rec.countLookupsToday()}")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bench(n, False)
+    bench(n, True)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Measure time to window: start ssmtool with --profile-startup on the
+offscreen Qt platform, wait for the "Time to window" milestone, and stop
+it. Settings and data go to a temporary directory so that every run
+starts from the same state.
+
+Usage: python benchmarks/bench_startup.py [runs] [--profile]
+(default: 5 runs; --profile prints the import profile of the last run)
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run_once(env):
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "ssmtool", "--profile-startup"],
+                            cwd=ROOT, env=env, stderr=subprocess.PIPE, text=True)
+    lines = []
+    try:
+        for line in proc.stderr:
+            lines.append(line)
+            if "Time to window" in line:
+                return (time.perf_counter() - start) * 1000, float(line.split()[0]), lines
+        raise RuntimeError("ssmtool exited before showing its window:\n" + "".join(lines))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(runs, profile):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen",
+                   XDG_DATA_HOME=os.path.join(tmp, "data"),
+                   XDG_CONFIG_HOME=os.path.join(tmp, "config"))
+        # The first run creates the databases
+        run_once(env)
+        wall, reported = [], []
+        for _ in range(runs):
+            total, ms, lines = run_once(env)
+            wall.append(total)
+            reported.append(ms)
+    if profile:
+        print("".join(lines))
+    print(f"time to window: median {statistics.median(wall):7.1f} ms, min {min(wall):7.1f} ms"
+          f" (from process start; {statistics.median(reported):.1f} ms after interpreter startup)")
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(int(args[0]) if args else 5, "--profile" in sys.argv)
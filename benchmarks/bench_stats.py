@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of computing today's statistics (lookups, notes) against
+records.db histories of different sizes: the old aggregate queries over
+unindexed tables versus the daily counters.
+
+Usage: python benchmarks/bench_stats.py [lookups ...]
+(default: 10000 100000 1000000)
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ssmtool.db import Record
+
+REPEAT = 50
+DAYS = 365
+
+
+def build_history(dbpath, n):
+    "n lookups and n/10 notes spread over the last year, without indexes"
+    conn = sqlite3.connect(dbpath)
+    conn.execute("""
+    CREATE TABLE lookups (
+        timestamp FLOAT, word TEXT, definition TEXT, language TEXT,
+        lemmatization INTEGER, source TEXT, success INTEGER
+    )
+    """)
+    conn.execute("CREATE TABLE notes (timestamp FLOAT, data TEXT, success INTEGER)")
+    now = time.time()
+    conn.executemany("INSERT INTO lookups VALUES(?, ?, ?, ?, ?, ?, ?)",
+        ((now - random.random() * DAYS * 86400, f"word{random.randrange(n // 10 + 1)}",
+          "definition", "English", 1, "wikt-en", 1) for _ in range(n)))
+    conn.executemany("INSERT INTO notes VALUES(?, ?, ?)",
+        ((now - random.random() * DAYS * 86400, "note", 1) for _ in range(n // 10)))
+    conn.commit()
+    conn.close()
+
+
+def legacy_stats(conn):
+    day = datetime.now()
+    start = day.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    end = day.replace(hour=23, minute=59, second=59, microsecond=999999).timestamp()
+    lookups = conn.execute("""SELECT COUNT (DISTINCT word) FROM lookups
+        WHERE timestamp BETWEEN ? AND ? AND success = 1""", (start, end)).fetchone()[0]
+    notes = conn.execute("""SELECT COUNT (timestamp) FROM notes
+        WHERE timestamp BETWEEN ? AND ? AND success = 1""", (start, end)).fetchone()[0]
+    return lookups, notes
+
+
+def timeit(fn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def bench(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        dbpath = os.path.join(tmp, "records.db")
+        build_history(dbpath, n)
+        conn = sqlite3.connect(dbpath)
+        before = timeit(lambda: legacy_stats(conn))
+        conn.close()
+        start = time.perf_counter()
+        rec = Record(dbpath)
+        migration = time.perf_counter() - start
+        after = timeit(lambda: (rec.countLookupsToday(), rec.countNotesToday()))
+        print(f"{n:>9} lookups | before {before:8.3f} ms | after {after:6.3f} ms"
+              f" | migration {migration:5.1f} s")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n in sizes:
+        bench(n)
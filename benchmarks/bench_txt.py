@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Measure plain text import on large generated files, in UTF-8 and in
+windows-1251: parsing throughput (MB/s) when chapters are consumed one at
+a time, and the peak memory used by the parser meanwhile, which should
+not grow with the size of the file. Then the whole import is measured:
+building the text (make_text), splitting and indexing its chapters
+(add_chapters) and annotating it, with its peak memory as a multiple of
+the file size.
+
+Usage: python benchmarks/bench_txt.py [megabytes ...]  (default: 10 100)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# The reader creates its database when imported
+tmp = tempfile.mkdtemp()
+os.environ["XDG_DATA_HOME"] = tmp
+from ssmtool.db import Record
+from ssmtool.ext.reader.utils import parseTxt
+from ssmtool.ext.reader.server import ReaderServer, app, db, make_text, add_chapters
+
+WORDS = {
+    "utf-8": "the house was quiet and the river ran past the old mill where nobody worked".split(),
+    "windows-1251": "дом стоял тихо и река текла мимо старой мельницы где никто не работал".split(),
+}
+HEADINGS = {"utf-8": "Chapter", "windows-1251": "Глава"}
+
+
+def write_txt(path, megabytes, encoding):
+    size, chapter = 0, 1
+    with open(path, "w", encoding=encoding) as f:
+        while size < megabytes * 1e6:
+            lines = [f"\n{HEADINGS[encoding]} {chapter}\n"]
+            for _ in range(200):
+                lines.append(" ".join(random.choices(WORDS[encoding], k=12)).capitalize() + ".\n")
+            text = "".join(lines)
+            f.write(text)
+            size += len(text.encode(encoding))
+            chapter += 1
+
+
+def consume(path):
+    chapters = 0
+    for chapter in parseTxt(path)["chapters"]:
+        chapters += 1
+    return chapters
+
+
+class Parent():
+    "Stands in for the main window, which the reader uses for its records"
+    rec = Record()
+
+
+def ingest(path):
+    with app.app_context():
+        text = make_text(parseTxt(path))
+        db.session.add(text)
+        db.session.flush()
+        add_chapters(text)
+        db.session.commit()
+        ReaderServer(Parent(), "127.0.0.1", 0).annotate(text)
+
+
+def main(sizes):
+    for megabytes in sizes:
+        for encoding in WORDS:
+            path = os.path.join(tmp, f"book-{encoding}.txt")
+            write_txt(path, megabytes, encoding)
+            start = time.perf_counter()
+            chapters = consume(path)
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            consume(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{megabytes:5} MB {encoding:>12}: {chapters:6} chapters in {elapsed:6.2f} s,"
+                  f" {os.path.getsize(path) / elapsed / 1e6:6.1f} MB/s, peak {peak / 1e6:5.1f} MB")
+            tracemalloc.start()
+            start = time.perf_counter()
+            ingest(path)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{'':>21} whole import in {elapsed:6.2f} s, peak {peak / 1e6:7.1f} MB"
+                  f" ({peak / os.path.getsize(path):.1f}x the file)")
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100])
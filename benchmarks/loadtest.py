@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Load test a running ssmtool instance: many clients on keep-alive
+connections request /define/<word> from the local API and /read/<id> from
+the web reader, and requests/sec and latency percentiles are reported.
+
+Usage: python benchmarks/loadtest.py [--api URL] [--reader URL] [--text ID]
+                                     [--clients N] [--seconds S]
+"""
+import argparse
+import http.client
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+WORDS = ["book", "read", "house", "water", "run", "green", "table", "light",
+         "friend", "letter", "river", "window", "speak", "strong", "cloud"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+def client(base, paths, stop, latencies, errors):
+    url = urlsplit(base)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            conn.request("GET", random.choice(paths)())
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(e)
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(name, base, paths, clients, seconds):
+    stop = threading.Event()
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(base, paths, stop, latencies, errors))
+               for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(f"{name:>8} | {len(latencies) / seconds:8.1f} req/s"
+          f" | p50 {percentile(latencies, 0.5) * 1000:7.1f} ms"
+          f" | p99 {percentile(latencies, 0.99) * 1000:7.1f} ms"
+          f" | {len(errors)} errors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--api", default="http://127.0.0.1:39284")
+    parser.add_argument("--reader", default="http://127.0.0.1:39285")
+    parser.add_argument("--text", type=int, default=1, help="id of a text in the reader")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    run("/define", args.api, [lambda: f"/define/{random.choice(WORDS)}"], args.clients, args.seconds)
+    run("/read", args.reader, [lambda: f"/read/{args.text}"], args.clients, args.seconds)
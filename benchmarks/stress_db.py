@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Hammer the API (/define, /stats, /logs) and the GUI lookup path
+concurrently against a local dictionary, while a dictionary is being
+reimported, and report any error raised by the database layer.
+All databases are created in a temporary data directory.
+
+Usage: python benchmarks/stress_db.py [seconds] [threads]
+(default: 10 8)
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+# Must be set before ssmtool.db resolves its data directory
+os.environ["XDG_DATA_HOME"] = tempfile.mkdtemp()
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ssmtool.db import Record
+from ssmtool.dictionary import dictdb, lookupin, invalidate_dictionary
+from ssmtool.api import create_app
+
+WORDS = 20000
+DICTNAME = "stress"
+
+
+class Window:
+    "The parts of the main window used by the API"
+    def __init__(self):
+        self.rec = Record(write_behind=True)
+
+    def lookup(self, word, use_lemmatize=True, record=True, deadline=None):
+        try:
+            item = lookupin(word, "en", False, DICTNAME)
+        except Exception:
+            self.rec.recordLookup(word, None, "English", False, DICTNAME, False)
+            return {"word": word, "definition": "<b>Definition for " + word + " not found.</b>"}
+        self.rec.recordLookup(word, item['definition'], "English", False, DICTNAME, True)
+        return item
+
+
+class Server:
+    def __init__(self, parent):
+        self.parent = parent
+
+
+def run(name, stop, errors, counts, fn):
+    n = 0
+    while not stop.is_set():
+        try:
+            fn()
+        except Exception:
+            errors.append((name, traceback.format_exc()))
+        n += 1
+    counts[name] = counts.get(name, 0) + n
+
+
+def main(seconds, threads):
+    dictdb.importdict(((f"word{i}", f"definition {i}") for i in range(WORDS)), "en", DICTNAME)
+    window = Window()
+    app = create_app(Server(window))
+
+    def api():
+        client = app.test_client()
+        word = f"word{random.randrange(WORDS * 2)}"
+        assert client.get(f"/define/{word}?lemmatize=false").status_code == 200
+        if random.random() < 0.05:
+            assert client.get("/stats").status_code == 200
+
+    def gui():
+        window.lookup(f"word{random.randrange(WORDS * 2)}")
+        window.rec.countLookupsToday()
+        window.rec.countQueued()
+        dictdb.countEntries()
+
+    def reimport():
+        dictdb.importdict(((f"extra{i}", "x") for i in range(WORDS)), "en", "extra")
+        invalidate_dictionary("en", "extra")
+        dictdb.deleteDict("en", "extra")
+
+    stop = threading.Event()
+    errors, counts = [], {}
+    workers = [threading.Thread(target=run, args=("api", stop, errors, counts, api)) for _ in range(threads)]
+    workers += [threading.Thread(target=run, args=("gui", stop, errors, counts, gui)) for _ in range(2)]
+    workers.append(threading.Thread(target=run, args=("import", stop, errors, counts, reimport)))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    window.rec.close()
+    for name, n in sorted(counts.items()):
+        print(f"{name:>6}: {n / seconds:8.0f} /s")
+    print(f"{len(window.rec.getAll())} lookups recorded, {len(errors)} errors")
+    for name, tb in errors[:5]:
+        print(name, tb)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    sys.exit(main(seconds, threads))
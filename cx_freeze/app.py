@@ -7,21 +7,20 @@ class dummyStream:
     def read(self,data): pass
     def flush(self): pass
     def close(self): pass
+# The startup profile is printed to stderr, so keep it when there is one
+stderr = sys.stderr if "--profile-startup" in sys.argv else None
 # redirect all streams to dummy to stop error on stdout
 sys.stdout = dummyStream()
-sys.stderr = dummyStream()
+sys.stderr = stderr or dummyStream()
 sys.stdin = dummyStream()
 sys.__stdout__ = dummyStream()
-sys.__stderr__ = dummyStream()
+sys.__stderr__ = stderr or dummyStream()
 sys.__stdin__ = dummyStream()
 
-from ssmtool.main import DictionaryWindow
-from PyQt5.QtWidgets import QApplication
+import multiprocessing
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    app.setApplicationName("ssmtool")
-    app.setOrganizationName("FreeLanguageTools")
-    w = DictionaryWindow()
-
-    w.show()
-    sys.exit(app.exec())
+    # Worker processes of the lemmatizer and reader ingest pools start this
+    # executable again; they must stop here before the app is imported
+    multiprocessing.freeze_support()
+    import ssmtool.__main__
+    ssmtool.__main__.main()
@@ -1,4 +1,4 @@
 #!/usr/bin/env python3
-import ssmtool.main
+import ssmtool.__main__
 if __name__ == "__main__":
-    ssmtool.main.main()
+    ssmtool.__main__.main()
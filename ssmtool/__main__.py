@@ -1,4 +1,13 @@
-from .main import main
+import sys
+from . import startup
+
+
+def main():
+    if "--profile-startup" in sys.argv:
+        sys.argv.remove("--profile-startup")
+        startup.enable()
+    from .main import main as start
+    start()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
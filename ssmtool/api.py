@@ -1,72 +1,154 @@
-from flask import Flask, request
+from flask import Flask, Response, request
 from PyQt5.QtCore import *
 from .dictionary import *
 from .db import Record
+from .serving import HTTPServer
 import logging
+import json
+import csv
+import io
+import os
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 def str2bool(v):
   return str(v).lower() in ("yes", "true", "t", "1")
 
+def log_item(row):
+    item = dict(zip(Record.LOG_COLUMNS, row))
+    item["cursor"] = f"{item['timestamp']!r}:{item.pop('rowid')}"
+    return item
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(log_item(row), ensure_ascii=False) + "\n"
+
+def csv_lines(rows):
+    header = [column for column in Record.LOG_COLUMNS if column != "rowid"] + ["cursor"]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(log_item(row).values())
+        yield buf.getvalue()
+
+def batch_lines(results):
+    for query, item, error in results:
+        if error is not None:
+            item = {"error": f"{type(error).__name__}: {error}"}
+        yield json.dumps({"query": query, **item}, ensure_ascii=False) + "\n"
+
+def create_app(server):
+    """ Main server application. Routes use server.parent (the main window)
+    for lookups and records and server.note_signal to create notes. """
+    app = Flask(__name__)
+    settings = QSettings()
+    @app.route("/healthcheck")
+    def healthcheck():
+        return "Hello, World!"
+
+    @app.route("/version")
+    def version():
+        return str(1)
+
+    @app.route("/define/<string:word>")
+    def lookup(word):
+        use_lemmatize = str2bool(request.args.get("lemmatize", "True")) 
+        deadline = request.args.get("deadline", type=float)
+        return server.parent.lookup(word, use_lemmatize, deadline=deadline)
+        
+    @app.route("/define/batch", methods=["POST"])
+    def define_batch():
+        """ Definitions of a list of words, streamed as NDJSON in the order
+        they become available """
+        data = request.json
+        lemmatize = str2bool(data.get("lemmatize", True))
+        results = server.parent.lookupMany(data["words"], lemmatize, data.get("dictionary"))
+        return Response(batch_lines(results), mimetype="application/x-ndjson")
+
+    @app.route("/translate", methods=["POST"])
+    def translate():
+        lang = request.args.get("src") or code[settings.value("target_language")]
+        gtrans_lang = request.args.get("dst") or code[settings.value("gtrans_lang")]
+        return {
+                "translation": googletranslate(request.json.get("text"), lang, gtrans_lang)['definition'], 
+                "src": lang, 
+                "dst": gtrans_lang}
+
+    @app.route("/createNote", methods=["POST"])
+    def createNote():
+        data = request.json
+        server.note_signal.emit(data['sentence'], data['word'], data['definition'], data['tags'])
+        return "success"
+    
+    @app.route("/stats")
+    def stats():
+        rec = server.parent.rec
+        return str(f"Today: {rec.countLookupsToday()} lookups, {rec.countNotesToday()} notes, {rec.countQueued()} queued")
+
+    @app.route("/lemmatize/<string:word>")
+    def lemmatize(word):
+        return lem_word(word, code[settings.value("target_language")])
+
+    @app.route("/lemmatize", methods=["POST"])
+    def lemmatize_batch():
+        """ Lemmas of a list of words, in the same order """
+        lang = request.args.get("lang") or code[settings.value("target_language")]
+        words = request.json["words"]
+        # Only very long lists are spread over processes
+        return {"lemmas": lemmatize_many(words, lang, os.cpu_count()), "lang": lang}
+
+    @app.route("/logs")
+    def logs():
+        """ Lookups, newest first, streamed as NDJSON (default) or CSV """
+        args = request.args
+        cursor = args.get("cursor")
+        if cursor:
+            try:
+                timestamp, rowid = cursor.split(":")
+                cursor = (float(timestamp), int(rowid))
+            except ValueError:
+                return Response("Invalid cursor", status=400)
+        language = args.get("language")
+        success = args.get("success")
+        rows = server.parent.rec.iterLookups(
+            since=args.get("since", type=float),
+            until=args.get("until", type=float),
+            language=code.inverse.get(language, language),
+            source=args.get("source"),
+            success=None if success is None else int(str2bool(success)),
+            cursor=cursor or None,
+            limit=args.get("limit", type=int))
+        if args.get("format") == "csv":
+            return Response(csv_lines(rows), mimetype="text/csv")
+        return Response(ndjson_lines(rows), mimetype="application/x-ndjson")
+
+    return app
+
 class LanguageServer(QObject):
     note_signal = pyqtSignal(str, str, str, list)
-    def __init__(self, parent, host, port):
+    def __init__(self, parent, host, port, options={}):
         super(LanguageServer, self).__init__()
         self.host = host
         self.port = port
         self.parent = parent
+        self.options = options
+        self.server = None
         
     def start_api(self):
-        """ Main server application """
-        self.app = Flask(__name__)
-        self.settings = QSettings()
-        @self.app.route("/healthcheck")
-        def healthcheck():
-            return "Hello, World!"
-
-        @self.app.route("/version")
-        def version():
-            return str(1)
-
-        @self.app.route("/define/<string:word>")
-        def lookup(word):
-            use_lemmatize = str2bool(request.args.get("lemmatize", "True")) 
-            return self.parent.lookup(word, use_lemmatize)
-            
-        @self.app.route("/translate", methods=["POST"])
-        def translate():
-            lang = request.args.get("src") or code[self.settings.value("target_language")]
-            gtrans_lang = request.args.get("dst") or code[self.settings.value("gtrans_lang")]
-            return {
-                    "translation": googletranslate(request.json.get("text"), lang, gtrans_lang)['definition'], 
-                    "src": lang, 
-                    "dst": gtrans_lang}
-
-        @self.app.route("/createNote", methods=["POST"])
-        def createNote():
-            data = request.json
-            self.note_signal.emit(data['sentence'], data['word'], data['definition'], data['tags'])
-            return "success"
-        
-        @self.app.route("/stats")
-        def stats():
-            rec = Record()
-            return str(f"Today: {rec.countLookupsToday()} lookups, {rec.countNotesToday()} notes")
-
-        @self.app.route("/lemmatize/<string:word>")
-        def lemmatize(word):
-            return lem_word(word, code[self.settings.value("target_language")])
-
-        @self.app.route("/logs")
-        def logs():
-            rec = Record()
-            return "\n".join([" ".join([str(i) for i in item]) for item in rec.getAll()][::-1])
-
+        self.app = create_app(self)
         try:
-            self.app.run(debug=False, use_reloader=False, host=self.host, port=self.port)
+            self.server = HTTPServer(self.app, self.host, self.port, **self.options)
         except OSError:
             return
+        self.server.serve()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
 
 if __name__ == "__main__":
     server = LanguageServer()
-    server.start_api()
\ No newline at end of file
+    server.start_api()
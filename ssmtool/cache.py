@@ -0,0 +1,88 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+def approx_size(value) -> int:
+    "Rough memory footprint of a cached value in bytes"
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(approx_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache():
+    """
+    Thread-safe least-recently-used cache, bounded both by the number of
+    items and by the approximate total size of the stored values.
+    A maxitems of 0 disables caching.
+    """
+    def __init__(self, maxitems=1000, maxbytes=32 * 1024 * 1024):
+        self.maxitems = maxitems
+        self.maxbytes = maxbytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, _ = self.items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = approx_size(value)
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            if self.maxitems <= 0 or size > self.maxbytes:
+                return
+            self.items[key] = (value, size)
+            self.size += size
+            self.evict()
+
+    def evict(self):
+        while self.items and (len(self.items) > self.maxitems or self.size > self.maxbytes):
+            _, (_, size) = self.items.popitem(last=False)
+            self.size -= size
+
+    def resize(self, maxitems=None, maxbytes=None):
+        with self.lock:
+            if maxitems is not None:
+                self.maxitems = maxitems
+            if maxbytes is not None:
+                self.maxbytes = maxbytes
+            self.evict()
+
+    def invalidate(self, predicate):
+        "Drop every key for which predicate(key) is true"
+        with self.lock:
+            for key in [key for key in self.items if predicate(key)]:
+                self.size -= self.items.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self.items),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        return len(self.items)
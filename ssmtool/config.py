@@ -3,6 +3,8 @@ from PyQt5.QtCore import Qt
 from .tools import *
 from .dictionary import *
 from .dictmanager import *
+from . import net
+from . import serving
 
 class SettingsDialog(QDialog):
     def __init__(self, parent):
@@ -32,6 +34,11 @@ class SettingsDialog(QDialog):
         self.dict_source = QComboBox()
         self.dict_source2 = QComboBox()
         self.freq_source = QComboBox()
+        self.lookup_cache_size = QSpinBox()
+        self.lookup_cache_size.setMaximum(100000)
+        self.lookup_cache_size.setSingleStep(100)
+        self.lookup_cache_size.setToolTip("Number of recent definitions kept in memory to speed up repeated lookups."
+            + "\nSet to 0 to disable.")
         self.gtrans_lang = QComboBox()
         self.note_type = QComboBox()
         self.sentence_field = QComboBox()
@@ -41,6 +48,8 @@ class SettingsDialog(QDialog):
         self.pronunciation_field = QComboBox()
         self.forvo = QCheckBox("Play Forvo pronunciation upon word selection")
         self.bold_word = QCheckBox("Bold word in sentence on lookup")
+        self.offline_mode = QCheckBox("Offline mode")
+        self.offline_mode.setToolTip("Answer lookups only from local dictionaries and previously cached online definitions.")
         self.note_type_url = QLabel("For a suitable note type, \
             download <a href=\"https://freelanguagetools.org/sample.apkg\">this file</a> \
                 and import it to your Anki collection.")
@@ -77,6 +86,28 @@ class SettingsDialog(QDialog):
         self.api_port.setMinimum(1024)
         self.api_port.setMaximum(49151)
 
+        self.http_timeout = QSpinBox()
+        self.http_timeout.setRange(1, 60)
+        self.http_timeout.setSuffix(" s")
+        self.http_timeout.setToolTip("Timeout for requests to online dictionaries and Forvo.")
+        self.lookup_deadline = QDoubleSpinBox()
+        self.lookup_deadline.setRange(0.1, 10)
+        self.lookup_deadline.setSingleStep(0.5)
+        self.lookup_deadline.setSuffix(" s")
+        self.lookup_deadline.setToolTip("How long to wait for the second dictionary and the frequency list."
+            + "\nResults arriving later are filled in when they come.")
+
+        self.server_backend = QComboBox()
+        self.server_backend.addItems(serving.available_backends())
+        self.server_backend.setToolTip("waitress is used if it is installed. werkzeug is the Flask development server.")
+        self.server_threads = QSpinBox()
+        self.server_threads.setRange(1, 64)
+        self.server_threads.setToolTip("Worker threads of each server (waitress only)")
+        self.server_timeout = QSpinBox()
+        self.server_timeout.setRange(1, 600)
+        self.server_timeout.setSuffix(" s")
+        self.server_timeout.setToolTip("Idle keep-alive connections are closed after this time.")
+
         self.reader_enabled = QCheckBox("Enable SSM Web Reader")
         self.reader_host = QLineEdit()
         self.reader_port = QSpinBox()
@@ -164,11 +195,13 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.tab1.layout.addRow(self.lemfreq)
         self.tab1.layout.addRow(self.bold_word)
         self.tab1.layout.addRow(self.forvo)
+        self.tab1.layout.addRow(self.offline_mode)
         self.tab1.layout.addRow(QLabel("Target language"), self.target_language)
         self.tab1.layout.addRow(QLabel("Dictionary source 1"), self.dict_source)
         self.tab1.layout.addRow(QLabel("Dictionary source 2"), self.dict_source2)
         self.tab1.layout.addRow(QLabel("Frequency list"), self.freq_source)
         self.tab1.layout.addRow(QLabel("Google translate: To"), self.gtrans_lang)
+        self.tab1.layout.addRow(QLabel("Lookup cache size"), self.lookup_cache_size)
         self.tab1.layout.addRow(QLabel("Web lookup preset"), self.web_preset)
         self.tab1.layout.addRow(QLabel("Custom URL pattern"), self.custom_url)
         self.tab1.layout.addRow(self.importdict)
@@ -192,6 +225,11 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.tab3.layout.addRow(self.reader_enabled)
         self.tab3.layout.addRow(QLabel("Web reader host"), self.reader_host)
         self.tab3.layout.addRow(QLabel("Web reader port"), self.reader_port)
+        self.tab3.layout.addRow(QLabel("Server backend"), self.server_backend)
+        self.tab3.layout.addRow(QLabel("Server threads"), self.server_threads)
+        self.tab3.layout.addRow(QLabel("Server connection timeout"), self.server_timeout)
+        self.tab3.layout.addRow(QLabel("Secondary lookup deadline"), self.lookup_deadline)
+        self.tab3.layout.addRow(QLabel("Online lookup timeout"), self.http_timeout)
 
         self.tab4.layout.addRow(QLabel("<b>All settings on this tab requires restart to take effect.</b>"))
         self.tab4.layout.addRow(self.allow_editing)
@@ -211,7 +249,9 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.lemfreq.clicked.connect(self.syncSettings)
         self.forvo.clicked.connect(self.syncSettings)
         self.bold_word.clicked.connect(self.syncSettings)
+        self.offline_mode.clicked.connect(self.syncSettings)
         self.freq_source.currentTextChanged.connect(self.syncSettings)
+        self.lookup_cache_size.valueChanged.connect(self.syncSettings)
         self.dict_source.currentTextChanged.connect(self.syncSettings)
         self.dict_source.currentTextChanged.connect(self.loadDict2Options)
         self.dict_source2.currentTextChanged.connect(self.syncSettings)
@@ -249,6 +289,11 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.reader_enabled.clicked.connect(self.syncSettings)
         self.reader_host.editingFinished.connect(self.syncSettings)
         self.reader_port.valueChanged.connect(self.syncSettings)
+        self.server_backend.currentTextChanged.connect(self.syncSettings)
+        self.server_threads.valueChanged.connect(self.syncSettings)
+        self.server_timeout.valueChanged.connect(self.syncSettings)
+        self.lookup_deadline.valueChanged.connect(self.syncSettings)
+        self.http_timeout.valueChanged.connect(self.syncSettings)
         self.text_scale.valueChanged.connect(self.syncSettings)
         self.orientation.currentTextChanged.connect(self.syncSettings)
 
@@ -314,6 +359,7 @@ If you find this tool useful, you can give it a star on Github and tell others a
     def loadSettings(self):
         self.forvo.setChecked(self.settings.value("forvo", False, type=bool))
         self.bold_word.setChecked(self.settings.value("bold_word", True, type=bool))
+        self.offline_mode.setChecked(self.settings.value("offline_mode", False, type=bool))
         self.allow_editing.setChecked(self.settings.value("allow_editing", True, type=bool))
         self.lemmatization.setChecked(self.settings.value("lemmatization", True, type=bool))
         self.lemfreq.setChecked(self.settings.value("lemfreq", False, type=bool))
@@ -325,6 +371,7 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.loadDict2Options()
         self.dict_source2.setCurrentText(self.settings.value("dict_source2", "Wiktionary (English)"))
         self.loadFreqSources()
+        self.lookup_cache_size.setValue(self.settings.value("lookup_cache_size", 1000, type=int))
         self.web_preset.setCurrentText(self.settings.value("web_preset", "English Wiktionary"))
         self.loadUrl()
         self.gtrans_lang.setCurrentText(self.settings.value("gtrans_lang", "English"))
@@ -339,6 +386,12 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.reader_enabled.setChecked(self.settings.value("reader_enabled", True, type=bool))
         self.reader_host.setText(self.settings.value("reader_host", "127.0.0.1"))
         self.reader_port.setValue(self.settings.value("reader_port", 39285, type=int))
+        options = serving.options(self.settings)
+        self.server_backend.setCurrentText(options["backend"])
+        self.server_threads.setValue(options["threads"])
+        self.server_timeout.setValue(options["timeout"])
+        self.lookup_deadline.setValue(self.settings.value("lookup_deadline", 2.0, type=float))
+        self.http_timeout.setValue(self.settings.value("http_timeout", 4, type=int))
 
         try:
             _ = getVersion(api)
@@ -440,11 +493,15 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.settings.setValue("lemmatization", self.lemmatization.isChecked())
         self.settings.setValue("lemfreq", self.lemfreq.isChecked())
         self.settings.setValue("bold_word", self.bold_word.isChecked())
+        self.settings.setValue("offline_mode", self.offline_mode.isChecked())
+        set_offline(self.offline_mode.isChecked())
         self.settings.setValue("orientation", self.orientation.currentText())
         self.settings.setValue("target_language", self.target_language.currentText())
         self.settings.setValue("dict_source", self.dict_source.currentText())
         self.settings.setValue("dict_source2", self.dict_source2.currentText())
         self.settings.setValue("freq_source", self.freq_source.currentText())
+        self.settings.setValue("lookup_cache_size", self.lookup_cache_size.value())
+        definition_cache.resize(self.lookup_cache_size.value())
         self.settings.setValue("gtrans_lang", self.gtrans_lang.currentText())
         self.settings.setValue("anki_api", self.anki_api.text())
         self.settings.setValue("api_enabled", self.api_enabled.isChecked())
@@ -453,6 +510,12 @@ If you find this tool useful, you can give it a star on Github and tell others a
         self.settings.setValue("reader_enabled", self.reader_enabled.isChecked())
         self.settings.setValue("reader_host", self.reader_host.text())
         self.settings.setValue("reader_port", self.reader_port.value())
+        self.settings.setValue("server_backend", self.server_backend.currentText())
+        self.settings.setValue("server_threads", self.server_threads.value())
+        self.settings.setValue("server_timeout", self.server_timeout.value())
+        self.settings.setValue("lookup_deadline", self.lookup_deadline.value())
+        self.settings.setValue("http_timeout", self.http_timeout.value())
+        net.configure(timeout=self.http_timeout.value())
         self.settings.setValue("text_scale", self.text_scale.value())
         self.settings.setValue("web_preset", self.web_preset.currentText())
         self.settings.setValue("custom_url", self.custom_url.text())
@@ -1,59 +1,396 @@
 import sqlite3
+import json
+import hashlib
+import threading
+import atexit
+import queue
+from contextlib import contextmanager
 from PyQt5.QtCore import QStandardPaths, QCoreApplication
 from os import path
 from pathlib import Path
 import time
+import logging
+from itertools import islice
 from datetime import datetime, timedelta
 datapath = QStandardPaths.writableLocation(QStandardPaths.DataLocation)
 Path(datapath).mkdir(parents=True, exist_ok=True)
 print(datapath)
+logger = logging.getLogger(__name__)
+def dayof(timestamp) -> str:
+    "Local calendar day of a timestamp, as used for the daily counters"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+class Lazy():
+    """
+    Stand-in for an object that is expensive to create (opening a database,
+    importing a library). The object is created by factory() on first
+    attribute access, and attributes are looked up on it from then on.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+        return self._obj
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+class Database():
+    """
+    Connection layer shared by the databases below, safe to use from the GUI,
+    worker and API threads at the same time. The database is in WAL mode, so
+    readers never block the writer or each other. Reads are served by a pool
+    of connections, each used by one thread at a time. All writes go through
+    a single writer connection, serialized by a lock, inside a transaction
+    that is committed when the block exits and rolled back on error.
+    Every connection keeps its compiled statements in a statement cache, so
+    repeated queries are not prepared again.
+    """
+    POOL_SIZE = 8
+    CACHED_STATEMENTS = 256
+    TIMEOUT = 30
+
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        self.lock = threading.RLock()
+        self.pool = queue.LifoQueue()
+        self.writer = self.connect()
+        self.writer.execute("PRAGMA journal_mode = WAL")
+
+    def connect(self):
+        conn = sqlite3.connect(self.dbpath, timeout=self.TIMEOUT, check_same_thread=False,
+                               cached_statements=self.CACHED_STATEMENTS)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @contextmanager
+    def reading(self):
+        "A read connection from the pool, returned to it afterwards"
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        try:
+            yield conn
+        finally:
+            if self.pool.qsize() < self.POOL_SIZE:
+                self.pool.put(conn)
+            else:
+                conn.close()
+
+    def query(self, sql: str, params=()) -> list:
+        with self.reading() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def queryone(self, sql: str, params=()):
+        with self.reading() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    @contextmanager
+    def writing(self):
+        "A cursor of the writer connection, holding the write lock"
+        with self.lock:
+            c = self.writer.cursor()
+            try:
+                yield c
+                self.writer.commit()
+            except Exception:
+                self.writer.rollback()
+                raise
+            finally:
+                c.close()
+
 class Record():
-    def __init__(self):
+    """
+    Lookup and note history. Besides the raw lookups and notes tables,
+    per-day counters (distinct successfully looked up words, added notes)
+    are maintained as events are recorded, so that the daily statistics
+    are a single-row read regardless of how long the history is.
+    Callbacks registered with addListener() are called after every change.
+
+    With write_behind, recordLookup() and recordNote() only buffer the
+    event in memory. Buffered events are written in a single transaction
+    every FLUSH_INTERVAL seconds, as soon as FLUSH_SIZE events are pending,
+    and on close() or interpreter exit. If the application crashes, at most
+    the events of the last FLUSH_INTERVAL seconds (and never more than
+    FLUSH_SIZE events) are lost; statistics lag behind by the same amount.
+    Events that cannot be written are kept and retried at the next flush.
+    The database uses WAL with synchronous=NORMAL, so a flushed transaction
+    survives an application crash, though a power failure may undo the most
+    recent ones.
+    """
+    SCHEMA_VERSION = 1
+    FLUSH_INTERVAL = 2.0
+    FLUSH_SIZE = 50
+
+    def __init__(self, dbpath=None, write_behind=False):
         #print(path.join(datapath, "records.db"))
-        self.conn = sqlite3.connect(path.join(datapath, "records.db"), check_same_thread=False)
-        self.c = self.conn.cursor()
+        self.db = Database(dbpath or path.join(datapath, "records.db"))
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.pending = []
+        self.write_behind = write_behind
         self.createTables()
+        self.migrate()
+        if write_behind:
+            self.wakeup = threading.Event()
+            self.closed = False
+            self.flusher = threading.Thread(target=self.flushLoop, name="records-flush", daemon=True)
+            self.flusher.start()
+            atexit.register(self.close)
 
     def createTables(self):
-        self.c.execute("""
-        CREATE TABLE IF NOT EXISTS lookups (
-            timestamp FLOAT,
-            word TEXT,
-            definition TEXT,
-            language TEXT,
-            lemmatization INTEGER,
-            source TEXT,
-            success INTEGER
-        )
-        """)
-        self.c.execute("""
-        CREATE TABLE IF NOT EXISTS notes (
-            timestamp FLOAT,
-            data TEXT,
-            success INTEGER
-        )
-        """)
-        self.conn.commit()
+        with self.db.writing() as c:
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS lookups (
+                timestamp FLOAT,
+                word TEXT,
+                definition TEXT,
+                language TEXT,
+                lemmatization INTEGER,
+                source TEXT,
+                success INTEGER
+            )
+            """)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS notes (
+                timestamp FLOAT,
+                data TEXT,
+                success INTEGER
+            )
+            """)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                timestamp FLOAT,
+                note TEXT,
+                key TEXT UNIQUE,
+                attempts INTEGER DEFAULT 0,
+                error TEXT
+            )
+            """)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS daily (
+                day TEXT PRIMARY KEY,
+                lookups INTEGER NOT NULL DEFAULT 0,
+                notes INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS daily_words (
+                day TEXT,
+                word TEXT,
+                PRIMARY KEY (day, word)
+            ) WITHOUT ROWID
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS lookups_timestamp ON lookups (timestamp)")
+            c.execute("CREATE INDEX IF NOT EXISTS notes_timestamp ON notes (timestamp)")
 
-    def recordLookup(self, word, definition, language, lemmatization, source, success):
+    def migrate(self):
+        "Fill the daily counters from the history recorded before they existed"
+        if self.db.queryone("PRAGMA user_version")[0] >= self.SCHEMA_VERSION:
+            return
+        with self.db.writing() as c:
+            c.execute("""
+            INSERT OR IGNORE INTO daily_words(day, word)
+            SELECT date(timestamp, 'unixepoch', 'localtime'), word
+            FROM lookups WHERE success = 1 AND word IS NOT NULL
+            """)
+            c.execute("""
+            INSERT OR REPLACE INTO daily(day, lookups, notes)
+            SELECT day, SUM(lookups), SUM(notes) FROM (
+                SELECT day, COUNT(*) AS lookups, 0 AS notes FROM daily_words GROUP BY day
+                UNION ALL
+                SELECT date(timestamp, 'unixepoch', 'localtime'), 0, COUNT(*)
+                FROM notes WHERE success = 1
+                GROUP BY date(timestamp, 'unixepoch', 'localtime')
+            ) GROUP BY day
+            """)
+            c.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def addListener(self, func):
+        self.listeners.append(func)
+
+    def notify(self):
+        for func in self.listeners:
+            func()
+
+    def flushLoop(self):
+        while not self.closed:
+            self.wakeup.wait(self.FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Failed events are pending again and retried next time
+                logger.exception("Could not write %d buffered events", len(self.pending))
+
+    def flush(self):
+        """
+        Write all buffered events in one transaction. If it fails, the
+        events are put back in front of those buffered meanwhile.
+        """
+        with self.lock:
+            events, self.pending = self.pending, []
+        if not events:
+            return
         try:
-            timestamp = time.time()
-            sql = """INSERT INTO lookups(timestamp, word, definition, language, lemmatization, source, success)
-                    VALUES(?,?,?,?,?,?,?)"""
-            self.c.execute(sql, (timestamp, word, definition, language, lemmatization, source, success))
-            self.conn.commit()
-        except sqlite3.ProgrammingError:
+            with self.db.writing() as c:
+                for kind, args in events:
+                    if kind == "lookup":
+                        self.writeLookup(c, *args)
+                    else:
+                        self.writeNote(c, *args)
+        except Exception:
+            with self.lock:
+                self.pending[:0] = events
+            raise
+        self.notify()
+
+    def close(self):
+        if self.write_behind and not self.closed:
+            self.closed = True
+            self.wakeup.set()
+            self.flusher.join()
+        self.flush()
+
+    def buffer(self, kind, args):
+        with self.lock:
+            self.pending.append((kind, args))
+            full = len(self.pending) >= self.FLUSH_SIZE
+        if full:
+            self.wakeup.set()
+
+    def recordLookup(self, word, definition, language, lemmatization, source, success):
+        args = (time.time(), word, definition, language, lemmatization, source, success)
+        if self.write_behind:
+            self.buffer("lookup", args)
             return
+        with self.db.writing() as c:
+            self.writeLookup(c, *args)
+        self.notify()
 
     def recordNote(self, data, success):
-        timestamp = time.time()
+        args = (time.time(), data, success)
+        if self.write_behind:
+            self.buffer("note", args)
+            return
+        with self.db.writing() as c:
+            self.writeNote(c, *args)
+        self.notify()
+
+    def writeLookup(self, c, timestamp, word, definition, language, lemmatization, source, success):
+        sql = """INSERT INTO lookups(timestamp, word, definition, language, lemmatization, source, success)
+                VALUES(?,?,?,?,?,?,?)"""
+        c.execute(sql, (timestamp, word, definition, language, lemmatization, source, success))
+        if success:
+            day = dayof(timestamp)
+            c.execute("INSERT OR IGNORE INTO daily_words(day, word) VALUES(?, ?)", (day, word))
+            if c.rowcount == 1:
+                c.execute("""
+                INSERT INTO daily(day, lookups) VALUES(?, 1)
+                ON CONFLICT(day) DO UPDATE SET lookups = lookups + 1
+                """, (day,))
+
+    def writeNote(self, c, timestamp, data, success):
         sql = "INSERT INTO notes(timestamp, data, success) VALUES(?,?,?)"
-        self.c.execute(sql, (timestamp, data, success))
-        self.conn.commit()
+        c.execute(sql, (timestamp, data, success))
+        if success:
+            c.execute("""
+            INSERT INTO daily(day, notes) VALUES(?, 1)
+            ON CONFLICT(day) DO UPDATE SET notes = notes + 1
+            """, (dayof(timestamp),))
+
+    def queueNote(self, note: dict) -> bool:
+        """Add a note to the outbox waiting to be sent to Anki.
+        Returns False if an identical note is already queued."""
+        key = hashlib.sha1(json.dumps(
+            [note.get('deckName'), note.get('modelName'), note.get('fields')],
+            sort_keys=True).encode("utf-8")).hexdigest()
+        with self.db.writing() as c:
+            c.execute("""
+            INSERT OR IGNORE INTO outbox(timestamp, note, key)
+            VALUES(?, ?, ?)
+            """, (time.time(), json.dumps(note), key))
+            return c.rowcount == 1
+
+    def getQueued(self, limit: int):
+        "Oldest queued notes as (id, note, attempts)"
+        rows = self.db.query("""
+        SELECT id, note, attempts FROM outbox
+        ORDER BY id LIMIT ?
+        """, (limit,))
+        return [(id, json.loads(note), attempts) for id, note, attempts in rows]
+
+    def dequeueNotes(self, ids: list):
+        with self.db.writing() as c:
+            c.executemany("DELETE FROM outbox WHERE id=?", [(id,) for id in ids])
+
+    def markAttempt(self, ids: list, error: str, rejected=True):
+        """Record the error of a failed attempt to send notes. Only attempts
+        rejected by Anki count towards dropping a note."""
+        with self.db.writing() as c:
+            c.executemany("""
+            UPDATE outbox SET attempts = attempts + ?, error = ?
+            WHERE id=?
+            """, [(int(rejected), error, id) for id in ids])
+
+    def countQueued(self) -> int:
+        return self.db.queryone("SELECT COUNT(*) FROM outbox")[0]
 
     def getAll(self):
-        self.c.execute("SELECT * FROM lookups")
-        return self.c.fetchall()
+        return self.db.query("SELECT * FROM lookups")
+
+    LOG_COLUMNS = ["rowid", "timestamp", "word", "definition", "language",
+                   "lemmatization", "source", "success"]
+
+    def iterLookups(self, since=None, until=None, language=None, source=None,
+                    success=None, cursor=None, limit=None, batch=500):
+        """
+        Lookups matching the filters, newest first, as tuples of LOG_COLUMNS.
+        Rows are fetched batch by batch following the timestamp index, so
+        memory use does not depend on the size of the history. cursor is a
+        (timestamp, rowid) pair: only rows older than it are returned.
+        """
+        where, params = [], []
+        for clause, value in [("timestamp >= ?", since), ("timestamp <= ?", until),
+                              ("language = ?", language), ("source = ?", source),
+                              ("success = ?", success)]:
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        where.append("(timestamp, rowid) < (?, ?)")
+        sql = f"""
+        SELECT {", ".join(self.LOG_COLUMNS)} FROM lookups
+        WHERE {" AND ".join(where)}
+        ORDER BY timestamp DESC, rowid DESC LIMIT ?
+        """
+        if cursor is None:
+            cursor = (float("inf"), 0)
+        while limit is None or limit > 0:
+            size = batch if limit is None else min(batch, limit)
+            rows = self.db.query(sql, (*params, *cursor, size))
+            yield from rows
+            if len(rows) < size:
+                return
+            cursor = (rows[-1][1], rows[-1][0])
+            if limit is not None:
+                limit -= size
+
+    def getLookedUp(self, language, since=None) -> set:
+        "Lowercased words successfully looked up in a language (by name), optionally since a timestamp"
+        sql = "SELECT DISTINCT word FROM lookups WHERE language = ? AND success = 1 AND word IS NOT NULL"
+        params = [language]
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            params.append(since)
+        return {row[0].lower() for row in self.db.query(sql, params)}
 
     def countLookupsToday(self):
         day = datetime.now()
@@ -64,99 +401,349 @@ class Record():
         return self.countNotesDay(day)
 
     def countLookupsDay(self, day):
-        start = day.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
-        end = day.replace(hour=23, minute=59, second=59, microsecond=999999).timestamp()
-        try:
-            self.c.execute("""SELECT COUNT (DISTINCT word) 
-                            FROM lookups 
-                            WHERE timestamp 
-                            BETWEEN ? AND ?
-                            AND success = 1 """, (start, end))
-            return self.c.fetchall()[0][0]
-        except sqlite3.ProgrammingError:
-            return
+        "Number of distinct words successfully looked up on a day"
+        res = self.db.queryone("SELECT lookups FROM daily WHERE day=?", (day.strftime("%Y-%m-%d"),))
+        return res[0] if res else 0
+
     def countNotesDay(self, day):
-        start = day.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
-        end = day.replace(hour=23, minute=59, second=59, microsecond=999999).timestamp()
-        try:
-            self.c.execute("""SELECT COUNT (timestamp) 
-                            FROM notes 
-                            WHERE timestamp 
-                            BETWEEN ? AND ?
-                            AND success = 1 """, (start, end))
-            return self.c.fetchall()[0][0]
-        except sqlite3.ProgrammingError:
-            return
+        res = self.db.queryone("SELECT notes FROM daily WHERE day=?", (day.strftime("%Y-%m-%d"),))
+        return res[0] if res else 0
 
     def purge(self):
-        self.c.execute("""
-        DROP TABLE IF EXISTS lookups,notes
-        """)
+        with self.db.writing() as c:
+            for table in ["lookups", "notes", "daily", "daily_words"]:
+                c.execute(f"DROP TABLE IF EXISTS {table}")
         self.createTables()
 
 class LocalDictionary():
-    def __init__(self):
+    """
+    Entries of all imported dictionaries are stored in a single `entries`
+    table keyed by dictionary id, with an index on (dict_id, word) so that
+    lookups never scan other dictionaries. Names, languages, entry counts and
+    a fingerprint (type, size, mtime, hash) of the source files are kept in
+    the `dictionaries` table. The schema version is tracked with
+    PRAGMA user_version; databases using the old flat `dictionary` table are
+    migrated automatically on first open.
+    """
+    SCHEMA_VERSION = 2
+    IMPORT_BATCH = 10000
+    # Below SQLite's limit on the number of host parameters
+    QUERY_BATCH = 500
+
+    def __init__(self, dbpath=None):
         #print(path.join(datapath, "dict.db"))
-        self.conn = sqlite3.connect(path.join(datapath, "dict.db"), check_same_thread=False)
-        self.c = self.conn.cursor()
+        self.db = Database(dbpath or path.join(datapath, "dict.db"))
         self.createTables()
+        self.migrate()
+        self.createIndexes()
 
     def createTables(self):
-        self.c.execute("""
-        CREATE TABLE IF NOT EXISTS dictionary (
-            word TEXT,
-            definition TEXT,
-            language TEXT,
-            dictname TEXT
-        )
+        with self.db.writing() as c:
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS dictionaries (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                language TEXT NOT NULL,
+                entries INTEGER NOT NULL DEFAULT 0,
+                type TEXT,
+                path TEXT,
+                size INTEGER,
+                mtime FLOAT,
+                hash TEXT,
+                UNIQUE (name, language)
+            )
+            """)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                dict_id INTEGER NOT NULL,
+                word TEXT,
+                definition TEXT
+            )
+            """)
+
+    def createIndexes(self):
+        with self.db.writing() as c:
+            c.execute("""
+            CREATE INDEX IF NOT EXISTS entries_word ON entries (dict_id, word)
+            """)
+
+    def getVersion(self) -> int:
+        return self.db.queryone("PRAGMA user_version")[0]
+
+    def migrate(self):
+        version = self.getVersion()
+        if version >= self.SCHEMA_VERSION:
+            return
+        with self.db.writing() as c:
+            if version < 1:
+                self.migrateFlatTable(c)
+            if version < 2:
+                c.execute("PRAGMA table_info(dictionaries)")
+                columns = [row[1] for row in c.fetchall()]
+                for column, coltype in [("type", "TEXT"), ("path", "TEXT"), ("size", "INTEGER"),
+                                        ("mtime", "FLOAT"), ("hash", "TEXT")]:
+                    if column not in columns:
+                        c.execute(f"ALTER TABLE dictionaries ADD COLUMN {column} {coltype}")
+            c.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def migrateFlatTable(self, c):
+        "Move entries from the flat table used before schema version 1"
+        c.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='table' AND name='dictionary'
         """)
-        self.conn.commit()
-    
-    def importdict(self, data: dict, lang: str, name: str):
-        for item in data.items():
-            self.c.execute("""
-            INSERT INTO dictionary(word, definition, language, dictname)
-            VALUES(?, ?, ?, ?)
-            """, (item[0], item[1], lang, name))
-        self.conn.commit()
+        if c.fetchone():
+            c.execute("""
+            INSERT OR IGNORE INTO dictionaries(name, language)
+            SELECT DISTINCT dictname, language FROM dictionary
+            """)
+            c.execute("""
+            INSERT INTO entries(dict_id, word, definition)
+            SELECT dictionaries.id, dictionary.word, dictionary.definition
+            FROM dictionary JOIN dictionaries
+            ON dictionaries.name = dictionary.dictname
+            AND dictionaries.language = dictionary.language
+            """)
+            c.execute("""
+            UPDATE dictionaries SET entries =
+            (SELECT COUNT(*) FROM entries WHERE dict_id = dictionaries.id)
+            """)
+            c.execute("DROP TABLE dictionary")
 
-    def define(self, word: str, lang: str, name: str) -> str:
-        self.c.execute("""
-        SELECT definition FROM dictionary
-        WHERE word=?
+    def getDictId(self, lang: str, name: str, c=None):
+        """Id of a dictionary, or None if it does not exist.
+        If a writer cursor is given, the dictionary is created if needed."""
+        sql = """
+        SELECT id FROM dictionaries
+        WHERE name=?
+        AND language=?
+        """
+        if c is None:
+            res = self.db.queryone(sql, (name, lang))
+            return res[0] if res else None
+        c.execute("INSERT OR IGNORE INTO dictionaries(name, language) VALUES(?, ?)", (name, lang))
+        c.execute(sql, (name, lang))
+        return c.fetchone()[0]
+
+    def importdict(self, data, lang: str, name: str, progress=None, replace=False):
+        """
+        Import entries from a dict or an iterable of (word, definition) rows
+        in a single transaction. With replace, the existing entries of the
+        dictionary are deleted in the same transaction, so they are kept if
+        the import fails. Rows are inserted with executemany in
+        batches of IMPORT_BATCH. When the database is empty, the index is
+        dropped for the duration of the load and built once at the end.
+        If given, progress is called with the number of entries imported
+        so far after every batch.
+        In WAL mode with synchronous=NORMAL the commit does not wait for an
+        fsync, so the journal pragmas formerly switched for the import are
+        no longer needed. The WAL is checkpointed and truncated afterwards
+        so it does not keep the size of the whole import on disk.
+        """
+        if isinstance(data, dict):
+            data = data.items()
+        rows = iter(data)
+        defer_index = self.countEntries() == 0
+        count = 0
+        with self.db.writing() as c:
+            c.execute("BEGIN")
+            dict_id = self.getDictId(lang, name, c)
+            if replace:
+                c.execute("DELETE FROM entries WHERE dict_id=?", (dict_id,))
+                c.execute("UPDATE dictionaries SET entries = 0 WHERE id=?", (dict_id,))
+            if defer_index:
+                c.execute("DROP INDEX IF EXISTS entries_word")
+            while batch := [(dict_id, word, definition)
+                            for word, definition in islice(rows, self.IMPORT_BATCH)]:
+                c.executemany("""
+                INSERT INTO entries(dict_id, word, definition)
+                VALUES(?, ?, ?)
+                """, batch)
+                count += len(batch)
+                if progress:
+                    progress(count)
+            c.execute("""
+            UPDATE dictionaries SET entries = entries + ?
+            WHERE id=?
+            """, (count, dict_id))
+            if defer_index:
+                c.execute("CREATE INDEX IF NOT EXISTS entries_word ON entries (dict_id, word)")
+        with self.db.writing() as c:
+            c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return count
+
+    def deleteDict(self, lang: str, name: str):
+        dict_id = self.getDictId(lang, name)
+        if dict_id is None:
+            return
+        with self.db.writing() as c:
+            c.execute("DELETE FROM entries WHERE dict_id=?", (dict_id,))
+            c.execute("DELETE FROM dictionaries WHERE id=?", (dict_id,))
+
+    def getDicts(self):
+        "List of (language, name) of all dictionaries in the database"
+        return self.db.query("SELECT language, name FROM dictionaries")
+
+    def getSource(self, lang: str, name: str):
+        "Type and fingerprint of the files a dictionary was imported from"
+        res = self.db.queryone("""
+        SELECT type, path, size, mtime, hash FROM dictionaries
+        WHERE name=?
         AND language=?
-        AND dictname=?
-        """,(word, lang, name))
-        return self.c.fetchone()[0]
+        """, (name, lang))
+        if res is None:
+            return None
+        return dict(zip(["type", "path", "size", "mtime", "hash"], res))
+
+    def setSource(self, lang: str, name: str, dicttype, fpath, size, mtime, hash):
+        with self.db.writing() as c:
+            c.execute("""
+            UPDATE dictionaries SET type=?, path=?, size=?, mtime=?, hash=?
+            WHERE name=?
+            AND language=?
+            """, (dicttype, fpath, size, mtime, hash, name, lang))
+
+    def define(self, word: str, lang: str, name: str) -> str:
+        return self.db.queryone("""
+        SELECT definition FROM entries
+        WHERE dict_id=(SELECT id FROM dictionaries WHERE name=? AND language=?)
+        AND word=?
+        """,(name, lang, word))[0]
+
+    def getRanks(self, lang: str, name: str) -> dict:
+        "All entries of a frequency list as {word: rank}"
+        with self.db.reading() as conn:
+            return {word: int(rank) for word, rank in conn.execute("""
+            SELECT word, definition FROM entries
+            WHERE dict_id=(SELECT id FROM dictionaries WHERE name=? AND language=?)
+            """, (name, lang))}
+
+    def warm(self, lang: str, name: str) -> int:
+        """Read through the index entries of a dictionary, so that they are
+        in the page cache by the time of the first lookup"""
+        return self.db.queryone("""
+        SELECT COUNT(word) FROM entries INDEXED BY entries_word
+        WHERE dict_id=(SELECT id FROM dictionaries WHERE name=? AND language=?)
+        """, (name, lang))[0]
+
+    def defineMany(self, words, lang: str, name: str) -> dict:
+        "Definitions of all the given words found in a dictionary, as {word: definition}"
+        dict_id = self.getDictId(lang, name)
+        if dict_id is None:
+            return {}
+        words = list(dict.fromkeys(words))
+        results = {}
+        with self.db.reading() as conn:
+            for i in range(0, len(words), self.QUERY_BATCH):
+                chunk = words[i:i + self.QUERY_BATCH]
+                # First definition wins, as in define()
+                for word, definition in conn.execute(f"""
+                SELECT word, definition FROM entries
+                WHERE dict_id=?
+                AND word IN ({", ".join("?" * len(chunk))})
+                """, (dict_id, *chunk)):
+                    results.setdefault(word, definition)
+        return results
 
     def countEntries(self) -> int:
-        self.c.execute("""
-        SELECT COUNT(*) FROM dictionary
-        """)
-        return self.c.fetchone()[0]
+        return self.db.queryone("""
+        SELECT COALESCE(SUM(entries), 0) FROM dictionaries
+        """)[0]
 
     def countDicts(self) -> int:
-        self.c.execute("""
-        SELECT COUNT(DISTINCT dictname) FROM dictionary
-        """)
-        return self.c.fetchone()[0]
+        return self.db.queryone("""
+        SELECT COUNT(DISTINCT name) FROM dictionaries
+        """)[0]
 
     def getNamesForLang(self, lang: str):
-        self.c.row_factory = lambda cursor, row: row[0]
-        self.c.execute("""
-        SELECT DISTINCT dictname FROM dictionary
+        return [name for name, in self.db.query("""
+        SELECT name FROM dictionaries
         WHERE language=?
-        """,(lang,))
-        res = self.c.fetchall()
-        self.c.row_factory = None
-        return res
+        """,(lang,))]
 
     def purge(self):
-        self.c.execute("""
-        DROP TABLE IF EXISTS dictionary
-        """)
+        with self.db.writing() as c:
+            c.execute("""
+            DROP TABLE IF EXISTS entries
+            """)
+            c.execute("""
+            DROP TABLE IF EXISTS dictionaries
+            """)
+        self.createTables()
+        self.createIndexes()
+
+class ResponseCache():
+    """
+    Parsed results of online dictionary lookups, keyed by source, word and
+    language, so that revisited words are answered without a network request.
+    Entries older than ttl seconds are not served (except as a last resort
+    when offline), and only the newest maxitems entries are kept.
+    """
+    def __init__(self, dbpath=None, ttl=30 * 24 * 3600, maxitems=200000):
+        self.db = Database(dbpath or path.join(datapath, "cache.db"))
+        self.ttl = ttl
+        self.maxitems = maxitems
+        self.puts = 0
+        self.createTables()
+
+    def createTables(self):
+        with self.db.writing() as c:
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                source TEXT,
+                word TEXT,
+                language TEXT,
+                data TEXT,
+                timestamp FLOAT,
+                PRIMARY KEY (source, word, language)
+            )
+            """)
+            c.execute("""
+            CREATE INDEX IF NOT EXISTS responses_timestamp ON responses (timestamp)
+            """)
+
+    def get(self, source: str, word: str, language: str, allow_stale=False):
+        res = self.db.queryone("""
+        SELECT data, timestamp FROM responses
+        WHERE source=?
+        AND word=?
+        AND language=?
+        """, (source, word, language))
+        if res is None:
+            return None
+        data, timestamp = res
+        if not allow_stale and time.time() - timestamp > self.ttl:
+            return None
+        return json.loads(data)
+
+    def put(self, source: str, word: str, language: str, data):
+        with self.db.writing() as c:
+            c.execute("""
+            INSERT OR REPLACE INTO responses(source, word, language, data, timestamp)
+            VALUES(?, ?, ?, ?, ?)
+            """, (source, word, language, json.dumps(data), time.time()))
+            self.puts += 1
+            evict = self.puts % 100 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        "Remove expired entries and everything beyond the newest maxitems"
+        with self.db.writing() as c:
+            c.execute("DELETE FROM responses WHERE timestamp < ?", (time.time() - self.ttl,))
+            c.execute("""
+            DELETE FROM responses WHERE timestamp <
+            (SELECT timestamp FROM responses ORDER BY timestamp DESC LIMIT 1 OFFSET ?)
+            """, (self.maxitems - 1,))
+
+    def count(self) -> int:
+        return self.db.queryone("SELECT COUNT(*) FROM responses")[0]
+
+    def purge(self):
+        with self.db.writing() as c:
+            c.execute("DROP TABLE IF EXISTS responses")
         self.createTables()
-        
+
 if __name__ == "__main__":
     db = Record()
     #db.recordLookup("word", "sample-def", True, "wikt-en")
@@ -1,18 +1,39 @@
 import json
 import urllib.request
 import unicodedata
-import simplemma
 import re
-from googletrans import Translator
-import requests
 from bs4 import BeautifulSoup
 from bidict import bidict
-import pymorphy2
+import time
+import logging
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
 from .db import *
 from .forvo import *
-translator = Translator()
-dictdb = LocalDictionary()
-langdata = simplemma.load_data('en')
+from .cache import LRUCache
+from .lemmatizer import Lemmatizer
+from . import net
+def make_translator():
+    from googletrans import Translator
+    return Translator()
+
+# Created on first use, so that starting the application does not pay for them
+translator = Lazy(make_translator)
+dictdb = Lazy(LocalDictionary)
+lemmatizer = Lemmatizer()
+# Shared by the GUI, the local API and the importers, since they all go through lookupin()
+definition_cache = LRUCache()
+# Persistent cache of online lookups, consulted before any network request
+response_cache = Lazy(ResponseCache)
+# In offline mode, online sources are only answered from response_cache
+offline = False
+# Frequency lists as {(language, name): {word: rank}}, kept in memory once used
+freq_ranks = {}
+freq_lock = threading.Lock()
+FREQ_MISS = -1
+lookup_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="lookup")
+logger = logging.getLogger(__name__)
 
 
 code = bidict({
@@ -39,19 +60,12 @@ code = bidict({
 
 wikt_languages = code.keys()
 gdict_languages = ['en', 'hi', 'es', 'fr', 'ja', 'ru', 'de', 'it', 'ko', 'ar', 'tr', 'pt']
-simplemma_languages = ['bg', 'ca', 'cy', 'da', 'de', 'en', 'es', 'et', 'fa', 'fi', 'fr',
-                       'ga', 'gd', 'gl', 'gv', 'hu', 'id', 'it', 'ka', 'la', 'lb', 'lt',
-                       'lv', 'nl', 'pt', 'ro', 'ru', 'sk', 'sl', 'sv', 'tr', 'uk', 'ur']
 dictionaries = {"Wiktionary (English)": "wikt-en",
                 "Google dictionary (Monolingual)": "gdict",
                 "Google translate": "gtrans"}
-
-
-
-try:
-    morph = pymorphy2.MorphAnalyzer(lang="ru")
-except ValueError:
-    morph = pymorphy2.MorphAnalyzer(lang="ru-old")
+# Hosts of the online sources, to connect to ahead of the first lookup
+source_urls = {"wikt-en": "https://en.wiktionary.org/",
+               "gdict": "https://api.dictionaryapi.dev/"}
 
 
 
@@ -106,38 +120,51 @@ def fmt_result(definitions):
 def lem_word(word, language):
     """Lemmatize a word. We will use PyMorphy for RU, simplemma for others, 
     and if that isn't supported , we give up."""
-    if language == 'ru':
-        return morph.parse(word)[0].normal_form
-    elif language in simplemma_languages:
-        global langdata
-        if langdata[0][0] != language:
-            langdata = simplemma.load_data(language)
-            return lem_word(word, language)
-        else:
-            return simplemma.lemmatize(word, langdata)
-    else:
-        return word
+    return lemmatizer.lemmatize(word, language)
+
+def lemmatize_many(words, language, processes=None):
+    "Lemmatize a list of words, returning the lemmas in the same order"
+    return lemmatizer.lemmatizeMany(words, language, processes)
+
+def set_offline(value: bool):
+    global offline
+    offline = value
+
+def cached_response(source, word, language, fetch):
+    """Return the cached response of an online source, or call fetch() and
+    cache its result. In offline mode, stale entries are served too and
+    nothing is fetched."""
+    data = response_cache.get(source, word, language, allow_stale=offline)
+    if data is not None:
+        return data
+    if offline:
+        raise Exception("Offline mode: no cached definition")
+    data = fetch()
+    response_cache.put(source, word, language, data)
+    return data
 
 def wiktionary(word, language, lemmatize=True):
     "Get definitions from Wiktionary"
-    try:
-        res = requests.get('https://en.wiktionary.org/api/rest_v1/page/definition/' + word, timeout=4)
-    except Exception as e:
-        print(e)
-
-    if res.status_code != 200:
-        raise Exception("Lookup error")
-    definitions = []
-    data = res.json()[language]
-    for item in data:
-        meanings = []
-        for defn in item['definitions']:
-            parsed_meaning = BeautifulSoup(defn['definition'], features="lxml")
-            meanings.append(parsed_meaning.text)
-
-        meaning_item = {"pos": item['partOfSpeech'], "meaning": meanings}
-        definitions.append(meaning_item)
-    return {"word": word, "definition": definitions}
+    def fetch():
+        try:
+            res = net.get('https://en.wiktionary.org/api/rest_v1/page/definition/' + word)
+        except Exception as e:
+            print(e)
+
+        if res.status_code != 200:
+            raise Exception("Lookup error")
+        definitions = []
+        data = res.json()[language]
+        for item in data:
+            meanings = []
+            for defn in item['definitions']:
+                parsed_meaning = BeautifulSoup(defn['definition'], features="lxml")
+                meanings.append(parsed_meaning.text)
+
+            meaning_item = {"pos": item['partOfSpeech'], "meaning": meanings}
+            definitions.append(meaning_item)
+        return definitions
+    return {"word": word, "definition": cached_response("wikt-en", word, language, fetch)}
 
 def googledict(word, language, lemmatize=True):
     """Google dictionary lookup. Note Google dictionary cannot provide
@@ -149,34 +176,59 @@ def googledict(word, language, lemmatize=True):
         # offers the brasillian one.
         language = "pt-BR"
 
-    try:
-        res = requests.get('https://api.dictionaryapi.dev/api/v2/entries/' + language + "/" + word, timeout=4)
-    except Exception as e:
-        print(e)
-    if res.status_code != 200:
-        raise Exception("Lookup error")
-    definitions = []
-    data = res.json()[0]
-    for item in data['meanings']:
-        meanings = []
-        for d in item['definitions']:
-            meanings.append(d['definition'])
-        meaning_item = {"pos": item.get('partOfSpeech', ""), "meaning": meanings}
-        definitions.append(meaning_item)
-    return {"word": word, "definition": definitions}
+    def fetch():
+        try:
+            res = net.get('https://api.dictionaryapi.dev/api/v2/entries/' + language + "/" + word)
+        except Exception as e:
+            print(e)
+        if res.status_code != 200:
+            raise Exception("Lookup error")
+        definitions = []
+        data = res.json()[0]
+        for item in data['meanings']:
+            meanings = []
+            for d in item['definitions']:
+                meanings.append(d['definition'])
+            meaning_item = {"pos": item.get('partOfSpeech', ""), "meaning": meanings}
+            definitions.append(meaning_item)
+        return definitions
+    return {"word": word, "definition": cached_response("gdict", word, language, fetch)}
 
 def googletranslate(word, language, gtrans_lang):
     "Google translation, through the googletrans python library"
-    return {"word": word, "definition": translator.translate(word, src=language, dest=gtrans_lang).text}
+    def fetch():
+        return translator.translate(word, src=language, dest=gtrans_lang).text
+    return {"word": word, "definition": cached_response("gtrans-" + gtrans_lang, word, language, fetch)}
+
 
+def cache_key(word, language, lemmatize, dictionary, gtrans_lang):
+    return (unicodedata.normalize('NFKC', word).strip(), language, bool(lemmatize), dictionary, gtrans_lang)
 
 def lookupin(word, language, lemmatize=True, dictionary="Wiktionary (English)", gtrans_lang="English"):
-    # Remove any punctuation other than a hyphen
-    # language is 
+    "Look up a word, answering from definition_cache when possible"
+    key = cache_key(word, language, lemmatize, dictionary, gtrans_lang)
+    item = definition_cache.get(key)
+    if item is None:
+        item = lookupin_uncached(word, language, lemmatize, dictionary, gtrans_lang)
+        definition_cache.put(key, item)
+    return dict(item)
+
+def invalidate_dictionary(language, dictionary):
+    "Forget cached definitions from a local dictionary that has been changed"
+    definition_cache.invalidate(lambda key: key[1] == language and key[3] == dictionary)
+    with freq_lock:
+        freq_ranks.pop((language, dictionary), None)
+
+def prepare_word(word, language, lemmatize=True):
+    "The form of a word looked up in dictionaries"
     if language == 'ru':
         word = removeAccents(word)
     if lemmatize:
         word = lem_word(word, language)
+    return word
+
+def lookupin_uncached(word, language, lemmatize=True, dictionary="Wiktionary (English)", gtrans_lang="English"):
+    word = prepare_word(word, language, lemmatize)
     dictid = dictionaries.get(dictionary)
     if dictid == "wikt-en":
         item = wiktionary(word, language, lemmatize)
@@ -190,10 +242,104 @@ def lookupin(word, language, lemmatize=True, dictionary="Wiktionary (English)",
         return {"word": word, "definition": dictdb.define(word, language, dictionary)}
     return item
 
+def timed(fn, *args):
+    "Call fn, returning (result, exception, seconds taken)"
+    start = time.perf_counter()
+    try:
+        return fn(*args), None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
+
+def fanout(jobs: dict, deadline=None, late=None):
+    """
+    Run jobs, a dict of name -> (fn, args), concurrently on lookup_executor.
+    deadline is a number of seconds, or a dict giving one per job (None
+    meaning no limit). Returns {name: (result, exception, seconds)} for
+    the jobs that finished in time. For the others, if late is given,
+    late(name, result, exception, seconds) is called once they finish.
+    """
+    start = time.perf_counter()
+    futures = {name: lookup_executor.submit(timed, fn, *args) for name, (fn, args) in jobs.items()}
+    results = {}
+    for name, future in futures.items():
+        limit = deadline.get(name) if isinstance(deadline, dict) else deadline
+        remaining = None if limit is None else max(0, limit - (time.perf_counter() - start))
+        try:
+            results[name] = future.result(timeout=remaining)
+        except TimeoutError:
+            if late:
+                future.add_done_callback(lambda f, name=name: late(name, *f.result()))
+    return results
+
+def lookup_many(words, language, lemmatize=True, dictionary="Wiktionary (English)",
+                gtrans_lang="English", concurrency=4):
+    """
+    Look up many words at once, yielding (word, item, error) as results
+    become available. Duplicates are looked up once. Words already in
+    definition_cache come first; local dictionaries are answered with
+    batched SQL queries, and online sources with at most concurrency
+    requests in flight at a time.
+    """
+    words = list(dict.fromkeys(word for word in words if word))
+    todo = []
+    for word in words:
+        item = definition_cache.get(cache_key(word, language, lemmatize, dictionary, gtrans_lang))
+        if item is None:
+            todo.append(word)
+        else:
+            yield word, dict(item), None
+
+    if dictionaries.get(dictionary) is None:
+        forms = [removeAccents(word) if language == 'ru' else word for word in todo]
+        if lemmatize:
+            forms = lemmatize_many(forms, language)
+        forms = dict(zip(todo, forms))
+        found = dictdb.defineMany(forms.values(), language, dictionary)
+        for word, form in forms.items():
+            if form not in found:
+                yield word, None, KeyError(form)
+                continue
+            item = {"word": form, "definition": found[form]}
+            definition_cache.put(cache_key(word, language, lemmatize, dictionary, gtrans_lang), item)
+            yield word, dict(item), None
+        return
+
+    todo = iter(todo)
+    running = {}
+    while True:
+        for word in islice(todo, concurrency - len(running)):
+            future = lookup_executor.submit(timed, lookupin, word, language, lemmatize, dictionary, gtrans_lang)
+            running[future] = word
+        if not running:
+            return
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            item, error, _ = future.result()
+            yield running.pop(future), item, error
+
+def get_ranks(language, dictionary) -> dict:
+    "The {word: rank} index of a frequency list, loaded on first use"
+    with freq_lock:
+        ranks = freq_ranks.get((language, dictionary))
+        if ranks is None:
+            start = time.perf_counter()
+            ranks = freq_ranks[(language, dictionary)] = dictdb.getRanks(language, dictionary)
+            logger.info("Loaded %d ranks of '%s' in %d ms", len(ranks), dictionary,
+                        (time.perf_counter() - start) * 1000)
+        return ranks
+
 def getFreq(word, language, lemfreq, dictionary):
+    "Rank of a word in a frequency list, FREQ_MISS if it is not in it"
     if lemfreq:
         word = lem_word(word, language)
-    return int(dictdb.define(word.lower(), language, dictionary))
+    return get_ranks(language, dictionary).get(word.lower(), FREQ_MISS)
+
+def getFreqMany(words, language, lemfreq, dictionary):
+    "Ranks of a list of words, e.g. all words of a sentence, in the same order"
+    if lemfreq:
+        words = lemmatize_many(words, language)
+    ranks = get_ranks(language, dictionary)
+    return [ranks.get(word.lower(), FREQ_MISS) for word in words]
 
 def getDictsForLang(lang: str, dicts: list):
     "Get the list of dictionaries for a given language"
@@ -7,6 +7,25 @@ from bidict import bidict
 
 supported_dict_formats = bidict({"stardict": "StarDict", "json": "Simple JSON", "migaku": "Migaku Dictionary", "freq": "Frequency list"})
 
+class DictTask(QObject):
+    """
+    Runs a dictionary database operation on a separate thread.
+    The function is called with a progress callback.
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object)
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+
+    def run(self):
+        try:
+            result = self.fn(self.progress.emit)
+        except Exception as e:
+            print(e)
+            result = None
+        self.finished.emit(result)
+
 class DictManager(QDialog):
     def __init__(self, parent):
         super().__init__(parent)
@@ -17,7 +36,7 @@ class DictManager(QDialog):
         self.initWidgets()
         self.setupWidgets()
         self.refresh()
-        self.initTimer()
+        self.showStats()
         #self.loadSettings()
         #self.setupAutosave()
 
@@ -31,13 +50,16 @@ class DictManager(QDialog):
         self.remove.clicked.connect(self.onRemove)
         self.rebuild = QPushButton("Rebuild dictionary database")
         self.rebuild.setToolTip("""\
-This will regenerate the database containing dictionary entries.
+This will update the database containing dictionary entries.
 This program store all dictionary entries into a single database in order to
-improve performance during lookups. The files must be in their original location
-to be reimported, otherwise this operation will fail.\
+improve performance during lookups. Only dictionaries whose files have changed
+are reimported. The files must be in their original location to be reimported,
+otherwise this operation will fail.\
         """)
         self.rebuild.clicked.connect(self.rebuildDB)
         self.bar = QStatusBar()
+        self.stats_label = QLabel()
+        self.bar.addPermanentWidget(self.stats_label)
 
     def setupWidgets(self):
         self.layout = QVBoxLayout(self)
@@ -49,8 +71,44 @@ to be reimported, otherwise this operation will fail.\
 
     def rebuildDB(self):
         self.status("Rebuilding database..")
-        dictrebuild(self.settings.value("custom_dicts", [], type=list))
-        self.status("Database rebuilt.")
+        dicts = self.settings.value("custom_dicts", [], type=list)
+        self.runTask(lambda progress: dictrebuild(dicts, progress), self.onRebuilt)
+
+    def onRebuilt(self, reimported):
+        if reimported is None:
+            self.status("Failed to rebuild database.")
+        elif reimported:
+            self.status("Database rebuilt. Reimported: " + ", ".join(reimported))
+        else:
+            self.status("Database is up to date.")
+
+    def runTask(self, fn, callback, progress=None):
+        """Run fn(progress) on a worker thread, then callback(result).
+        Progress goes to the status bar unless another slot is given."""
+        self.setBusy(True)
+        self.task_thread = QThread()
+        self.task = DictTask(fn)
+        self.task.moveToThread(self.task_thread)
+        self.task_callback = callback
+        self.task_thread.started.connect(self.task.run)
+        self.task.progress.connect(progress or self.onTaskProgress)
+        self.task.finished.connect(self.task_thread.quit)
+        self.task.finished.connect(self.onTaskFinished)
+        self.task_thread.start()
+
+    def onTaskProgress(self, count):
+        self.status(f"Importing: {count} entries")
+
+    def onTaskFinished(self, result):
+        self.setBusy(False)
+        self.task_callback(result)
+
+    def setBusy(self, busy):
+        self.add.setEnabled(not busy)
+        self.remove.setEnabled(not busy)
+        self.rebuild.setEnabled(not busy)
+        if not busy:
+            self.showStats()
 
     def onAdd(self):
         fdialog = QFileDialog()
@@ -70,10 +128,14 @@ to be reimported, otherwise this operation will fail.\
         dicts = self.settings.value("custom_dicts", type=list)
         if dicts == []:
             return
-        del dicts[index.row()]
+        item = dicts.pop(index.row())
         self.settings.setValue("custom_dicts", dicts)
         self.refresh()
-        self.rebuildDB()
+        self.status(f"Removing {item['name']}..")
+        self.runTask(lambda _: dictremove(item), self.onRemoved)
+
+    def onRemoved(self, _):
+        self.status("Dictionary removed.")
     
     def refresh(self):
         dicts = self.settings.value("custom_dicts", [], type=list)
@@ -89,23 +151,31 @@ to be reimported, otherwise this operation will fail.\
 
     def time(self):
         return QDateTime.currentDateTime().toString('[hh:mm:ss]')
+    def busy(self):
+        return hasattr(self, "task_thread") and self.task_thread.isRunning()
+
+    def reject(self):
+        # The import can't be interrupted, so stay open until it is done
+        if self.busy():
+            self.status("Please wait until the database operation is finished.")
+            return
+        super().reject()
+
     def closeEvent(self, event):
+        if self.busy():
+            self.status("Please wait until the database operation is finished.")
+            event.ignore()
+            return
         self.parent.loadDictionaries()
         self.parent.loadDict2Options()
         self.parent.loadFreqSources()
         event.accept()
 
-    def initTimer(self):
-        self.showStats()
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.showStats)
-        self.timer.start(500)
-
     def showStats(self):
+        "Called whenever the dictionary database may have changed"
         n_dicts = dictdb.countDicts()
         n_entries = dictdb.countEntries()
-        if self.bar.currentMessage() == "":
-            self.status(f"Total: {n_dicts} dictionaries, {n_entries} entries.")
+        self.stats_label.setText(f"Total: {n_dicts} dictionaries, {n_entries} entries.")
 
 
 class AddDictDialog(QDialog):
@@ -116,6 +186,7 @@ class AddDictDialog(QDialog):
         self.setWindowTitle("Add Dictionary")
         self.resize(250, 150)
         self.fname = fname
+        self.importing = False
 
         if dictinfo(self.fname) == "Unsupported format":
             self.warn("Unsupported format")
@@ -152,22 +223,50 @@ class AddDictDialog(QDialog):
 
 
     def commit(self):
-        dictimport(
-            self.path, 
-            supported_dict_formats.inverse[self.type.currentText()], 
-            code[self.lang.currentText()], 
-            self.name.text())
+        self.commit_button.setEnabled(False)
+        self.progress = QProgressDialog(f"Importing {self.name.text()}..", None, 0, 0, self)
+        self.progress.setWindowTitle("Add Dictionary")
+        self.progress.setWindowModality(Qt.WindowModal)
+        self.progress.setMinimumDuration(0)
+        self.progress.show()
+        self.item = {"name": self.name.text(),
+                "type": supported_dict_formats.inverse[self.type.currentText()],
+                "path": self.path,
+                "lang": code[self.lang.currentText()]}
+        self.parent.status(f"Importing {self.name.text()} to database..")
+        self.importing = True
+        item = self.item
+        self.parent.runTask(lambda progress: dictadd(item, progress), self.onImported, self.onProgress)
+
+    def onProgress(self, count):
+        self.progress.setLabelText(f"Importing {self.item['name']}: {count} entries")
+
+    def onImported(self, count):
+        self.importing = False
+        self.progress.close()
+        if count is None:
+            self.parent.status(f"Failed to import {self.item['name']}.")
+            self.warn(f"Failed to import {self.item['name']}.")
+            self.commit_button.setEnabled(True)
+            return
         dicts = self.settings.value("custom_dicts", [], type=list)
-        dicts.append({"name": self.name.text(), 
-                      "type": supported_dict_formats.inverse[self.type.currentText()], 
-                      "path": self.path, 
-                      "lang": code[self.lang.currentText()]})
+        dicts.append(self.item)
         self.settings.setValue("custom_dicts", dicts)
-        self.parent.status(f"Importing {self.name.text()} to database..")
         self.parent.refresh()
         self.parent.status("Importing done.")
         self.close()
 
+    def reject(self):
+        # Closing is deferred to onImported while the import runs
+        if self.importing:
+            return
+        super().reject()
+
+    def closeEvent(self, event):
+        if self.importing:
+            event.ignore()
+            return
+        event.accept()
 
     def warn(self, text):
         msg = QMessageBox()
@@ -1 +1,8 @@
-from .server import ReaderServer
\ No newline at end of file
+# The server is imported on first use only: worker processes of the ingest
+# pool import the parsers from this package, and must not start the whole
+# reader (Qt, Flask and its database) to do so
+def __getattr__(name):
+    if name == "ReaderServer":
+        from .server import ReaderServer
+        return ReaderServer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,121 @@
+"""
+Background ingestion of uploaded books. Uploads are queued as jobs and
+handled one at a time by an ingest thread: the book is parsed, using a
+pool of processes for large EPUB and FB2 files, then saved by a callback. The status of every job
+since startup can be queried while it runs.
+"""
+import os
+import time
+import queue
+import threading
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from .utils import parseBook
+
+logger = logging.getLogger(__name__)
+
+# Smaller books are parsed on the ingest thread
+POOL_MIN_SIZE = 1 << 20
+
+
+class Job():
+    def __init__(self, id, path):
+        self.id = id
+        self.path = path
+        self.status = "queued"
+        self.error = None
+        self.text_id = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def asdict(self) -> dict:
+        return {
+            "id": self.id,
+            "filename": os.path.basename(self.path),
+            "status": self.status,
+            "error": self.error,
+            "text_id": self.text_id,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue():
+    """
+    Jobs go through queued, parsing and saving, and end as done or failed.
+    save(book) is called on the ingest thread and returns the id of the
+    saved text.
+    """
+    def __init__(self, save, processes=None):
+        self.save = save
+        self.processes = processes or os.cpu_count() or 1
+        self.pool = None
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="reader-ingest", daemon=True)
+        self.thread.start()
+
+    def submit(self, path) -> Job:
+        with self.lock:
+            job = Job(next(self.ids), path)
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def get(self, id):
+        return self.jobs.get(id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                # Jobs run one at a time and wait for their parsing, so
+                # no work is left in the pool at this point
+                if self.pool is not None:
+                    self.pool.shutdown()
+                return
+            job.started = time.time()
+            try:
+                job.status = "parsing"
+                book = parseBook(job.path, self.poolFor(job.path))
+                job.status = "saving"
+                job.text_id = self.save(book)
+                job.status = "done"
+            except Exception as e:
+                logger.exception("Could not import %s", job.path)
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            job.finished = time.time()
+            logger.info("Job %d (%s) %s in %d ms", job.id, os.path.basename(job.path),
+                        job.status, (job.finished - job.started) * 1000)
+
+    def poolFor(self, path):
+        "The process pool to parse a book with, None if it is not worth it"
+        if os.path.splitext(path)[1] == ".txt" or os.path.getsize(path) < POOL_MIN_SIZE:
+            return None
+        if self.pool is None:
+            # Started on first use, so that idle readers cost no processes
+            self.pool = ProcessPoolExecutor(self.processes)
+        return self.pool
+
+    def close(self, timeout=10):
+        """
+        Drop the queued jobs, wait up to timeout seconds for the current
+        one to finish and stop the worker processes.
+        """
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put(None)
+        self.thread.join(timeout)
@@ -1,12 +1,23 @@
-from flask import Flask, render_template, flash, request, redirect, url_for
+from flask import Flask, Response, render_template, flash, request, redirect, url_for, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text as sql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import defer
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import os
 import re
+import json
+import html
+import time
+import logging
+import threading
 from .utils import *
-from PyQt5.QtCore import QStandardPaths, QCoreApplication, QObject, pyqtSignal
+from .jobs import JobQueue
+from PyQt5.QtCore import QStandardPaths, QCoreApplication, QObject, pyqtSignal, QSettings
 from pathlib import Path
+from ...serving import HTTPServer
+from ...dictionary import code, lemmatize_many, get_ranks, FREQ_MISS, dictdb
 # The following import is to avoid cxfreeze error
 import sqlalchemy.sql.default_comparator
 
@@ -20,7 +31,7 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['SECRET_KEY'] = "abc"
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{datapath}/reader.db"
 db = SQLAlchemy(app)
-
+logger = logging.getLogger(__name__)
 
 
 class Text(db.Model):
@@ -33,39 +44,416 @@ class Text(db.Model):
     content = db.Column(db.Text, nullable=False)
     progress = db.Column(db.Integer, nullable=False, default=0)
     length = db.Column(db.Integer, nullable=False)
+    # Reading position: chapter number and character offset in the chapter
+    chapter = db.Column(db.Integer, nullable=False, default=0)
+    position = db.Column(db.Integer, nullable=False, default=0)
 
     def __repr__(self):
         return f"Text(ID={self.id}, Title={self.title})"
 
+class Chapter(db.Model):
+    """
+    A chapter of a text: its title and the character range of its body in
+    Text.content, so that a chapter can be read without loading the rest
+    of the book.
+    """
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), primary_key=True)
+    number = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(400), nullable=False)
+    start = db.Column(db.Integer, nullable=False)
+    end = db.Column(db.Integer, nullable=False)
+    words = db.Column(db.Integer, nullable=False)
+
+    def asdict(self):
+        return {"number": self.number, "title": self.title, "start": self.start,
+                "end": self.end, "words": self.words}
+
+class Annotation(db.Model):
+    """
+    Vocabulary of a text: {word: [lemma, frequency rank, looked up before]}
+    for every distinct lowercased word, as compact JSON. It is only valid
+    for the language, frequency list and lemmatization setting it was
+    computed with; `freq_hash` is the hash of the frequency list's files when
+    it was imported, so that reimporting a list under the same name also
+    invalidates it. `created` is when the looked up flags were last updated.
+    """
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), primary_key=True)
+    language = db.Column(db.String(40), nullable=False)
+    freq_source = db.Column(db.String(180), nullable=False)
+    lemfreq = db.Column(db.Boolean, nullable=False)
+    freq_hash = db.Column(db.String(40), nullable=False, default="")
+    created = db.Column(db.Float, nullable=False)
+    data = db.Column(db.Text, nullable=False)
+
 db.create_all()
+
+def migrate():
+    "Add the columns introduced after the tables were created"
+    added = {
+        "text": {"chapter": "INTEGER NOT NULL DEFAULT 0", "position": "INTEGER NOT NULL DEFAULT 0"},
+        "annotation": {"freq_hash": "VARCHAR(40) NOT NULL DEFAULT ''"},
+    }
+    with db.engine.begin() as conn:
+        for table, definitions in added.items():
+            columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+            for column, definition in definitions.items():
+                if column not in columns:
+                    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+migrate()
+
+# Full-text index of chapters. Rows are keyed by text id and chapter
+# number packed into the rowid, so that the chapters of a text are a
+# rowid range and can be removed without scanning the index.
+CHAPTER_BITS = 20
+INDEX_BATCH = 16
+SEARCH_LIMIT = 20
+try:
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chapter_search
+        USING fts5(title, body, tokenize = 'unicode61 remove_diacritics 2')
+        """)
+    fts = True
+except OperationalError:
+    logger.warning("SQLite was built without FTS5, library search is disabled")
+    fts = False
+
+def search_rowids(text_id):
+    return {"first": text_id << CHAPTER_BITS, "last": ((text_id + 1) << CHAPTER_BITS) - 1}
+
+def index_chapters(text, chapters):
+    "Add the chapters of a text to the search index, in the current transaction"
+    if not fts:
+        return
+    db.session.execute(sql("DELETE FROM chapter_search WHERE rowid BETWEEN :first AND :last"),
+                       search_rowids(text.id))
+    # A few chapters at a time, so that the bodies are not all copied at once
+    for i in range(0, len(chapters), INDEX_BATCH):
+        db.session.execute(sql("INSERT INTO chapter_search(rowid, title, body) VALUES (:rowid, :title, :body)"),
+                           [{"rowid": (text.id << CHAPTER_BITS) + chapter.number, "title": chapter.title,
+                             "body": text.content[chapter.start:chapter.end]}
+                            for chapter in chapters[i:i + INDEX_BATCH]])
+
+def unindex_text(text_id):
+    if fts:
+        db.session.execute(sql("DELETE FROM chapter_search WHERE rowid BETWEEN :first AND :last"),
+                           search_rowids(text_id))
+
+def index_library():
+    "Index the texts added before the search index existed"
+    with app.app_context():
+        ids = [row[0] for row in db.session.execute(sql("""
+            SELECT id FROM text WHERE NOT EXISTS (
+                SELECT 1 FROM chapter_search WHERE rowid BETWEEN text.id << :bits AND ((text.id + 1) << :bits) - 1)
+            """), {"bits": CHAPTER_BITS})]
+        for text_id in ids:
+            text = Text.query.get(text_id)
+            chapters = Chapter.query.filter_by(text_id=text_id).all()
+            if chapters:
+                index_chapters(text, chapters)
+            else:
+                add_chapters(text)
+            db.session.commit()
+            db.session.expunge_all()
+        if ids:
+            logger.info("Indexed %d texts for search", len(ids))
+
+def search(query, limit=SEARCH_LIMIT):
+    """
+    Chapters matching all words of a query, the last one as a prefix, best
+    first (bm25, with title matches counting more). Each result has a
+    snippet, with the matches in <mark>, and the offset of the line of the
+    first match in the chapter.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return []
+    match = " ".join(f'"{word}"' for word in words) + "*"
+    rows = db.session.execute(sql("""
+        SELECT chapter_search.rowid, chapter_search.title, body,
+               snippet(chapter_search, 1, char(2), char(3), '…', 24), text.title
+        FROM chapter_search JOIN text ON text.id = chapter_search.rowid >> :bits
+        WHERE chapter_search MATCH :match
+        ORDER BY bm25(chapter_search, 10.0, 1.0) LIMIT :limit
+        """), {"match": match, "bits": CHAPTER_BITS, "limit": limit})
+    first_word = re.compile("|".join(re.escape(word) for word in words), re.I)
+    results = []
+    for rowid, chapter_title, body, snippet, title in rows:
+        found = first_word.search(body)
+        position = body.rfind("\n", 0, found.start()) + 1 if found else 0
+        results.append({
+            "text_id": rowid >> CHAPTER_BITS,
+            "title": title,
+            "chapter": rowid & ((1 << CHAPTER_BITS) - 1),
+            "chapter_title": chapter_title,
+            "position": position,
+            "snippet": html.escape(snippet).replace("\x02", "<mark>").replace("\x03", "</mark>"),
+        })
+    return results
+
+def split_chapters(content):
+    "Chapters of a text in the ###### format, as Chapter objects without text_id"
+    markers = [m.start() for m in re.finditer("######", content)] + [len(content)]
+    chapters = []
+    for number, (marker, end) in enumerate(zip(markers, markers[1:])):
+        newline = content.find("\n", marker, end)
+        start = end if newline == -1 else newline + 1
+        # Leave out the blank lines between chapters
+        body = content[start:end].rstrip("\n")
+        chapters.append(Chapter(number=number, title=content[marker + 6:start].strip(),
+                                start=start, end=start + len(body),
+                                words=count_words(body)))
+    return chapters
+
+def get_chapters(text_id):
+    "The chapters of a text, split and stored first for texts added before chapters existed"
+    chapters = Chapter.query.filter_by(text_id=text_id).order_by(Chapter.number).all()
+    if not chapters:
+        text = Text.query.get_or_404(text_id)
+        add_chapters(text)
+        db.session.commit()
+        chapters = Chapter.query.filter_by(text_id=text_id).order_by(Chapter.number).all()
+    return chapters
+
+def add_chapters(text):
+    "Store the chapters of a text, count its words and index them for search"
+    chapters = split_chapters(text.content)
+    for chapter in chapters:
+        chapter.text_id = text.id
+        db.session.add(chapter)
+    text.length = sum(chapter.words for chapter in chapters)
+    index_chapters(text, chapters)
+
+def resume_position(text, chapters):
+    """
+    Set the reading position of a text read before positions were stored
+    as (chapter, offset), from its overall progress in millionths.
+    """
+    if not chapters:
+        return
+    target = text.progress * max(chapter.end for chapter in chapters) // 1_000_000
+    chapter = chapters[0]
+    for candidate in chapters:
+        if candidate.start > target:
+            break
+        chapter = candidate
+    text.chapter = chapter.number
+    text.position = min(max(target - chapter.start, 0), chapter.end - chapter.start)
+    db.session.commit()
+
+def chapter_lines(body):
+    "Lines of a chapter body with their character offset in it"
+    offset = 0
+    for line in body.split("\n"):
+        yield offset, line
+        offset += len(line) + 1
+
 class ReaderServer(QObject):
-    def __init__(self, parent, host, port):
+    def __init__(self, parent, host, port, options={}):
         super(ReaderServer, self).__init__()
         self.host = host
         self.port = port
         self.parent = parent
-        
+        self.options = options
+        self.server = None
+        self.jobs = None
+        self.settings = QSettings()
+        # language: (time, looked up words, their lemmas)
+        self.looked_up = {}
+        self.looked_up_lock = threading.Lock()
+
+    def annotationKey(self):
+        "The settings an annotation depends on, and the hash of the frequency list"
+        language = self.settings.value("target_language", "English")
+        freq_source = self.settings.value("freq_source", "Disabled")
+        source = dictdb.getSource(code[language], freq_source) if freq_source != "Disabled" else None
+        return (language, freq_source, self.settings.value("lemfreq", True, type=bool),
+                (source and source['hash']) or "")
+
+    def lookedUp(self, language):
+        """
+        Words looked up in a language and their lemmas. Both are kept, so
+        that only lookups made since the last call are lemmatized instead
+        of the whole history every time a text is annotated.
+        """
+        rec = self.parent.rec
+        with self.looked_up_lock:
+            now = time.time()
+            since, words, lemmas = self.looked_up.get(language, (None, set(), set()))
+            # Lookups reach the database up to a flush interval after they happen
+            new = rec.getLookedUp(language, since=since and since - rec.FLUSH_INTERVAL) - words
+            if new:
+                words = words | new
+                lemmas = lemmas | {lemma.lower() for lemma in lemmatize_many(list(new), code[language])}
+            self.looked_up[language] = (now, words, lemmas)
+            return words, lemmas
+
+    def annotate(self, text):
+        """
+        Compute and store the annotation of a text in one pass: all distinct
+        words are lemmatized together, ranked against the in-memory index of
+        the frequency list and checked against the lookup history.
+        """
+        start = time.time()
+        language, freq_source, lemfreq, freq_hash = self.annotationKey()
+        lang = code[language]
+        words = [word for word in dict.fromkeys(m.group().lower() for m in re.finditer(r'\w+', text.content))
+                 if not word.isdigit()]
+        lemmas = lemmatize_many(words, lang, os.cpu_count())
+        ranks = get_ranks(lang, freq_source) if freq_source != "Disabled" else {}
+        seen, seen_lemmas = self.lookedUp(language)
+        annotations = {}
+        for word, lemma in zip(words, lemmas):
+            lemma = lemma.lower()
+            rank = ranks.get(lemma if lemfreq else word, FREQ_MISS)
+            annotations[word] = [lemma, rank, int(word in seen or lemma in seen_lemmas)]
+        annotation = Annotation(text_id=text.id, language=language, freq_source=freq_source,
+                                lemfreq=lemfreq, freq_hash=freq_hash, created=start,
+                                data=json.dumps(annotations, ensure_ascii=False, separators=(",", ":")))
+        db.session.merge(annotation)
+        db.session.commit()
+        logger.info("Annotated %d words of %s in %d ms", len(words), text, (time.time() - start) * 1000)
+        return Annotation.query.get(text.id)
+
+    def getAnnotation(self, text):
+        """
+        The annotation of a text, recomputed if the language or the frequency
+        list, or the list's contents, changed since it was made. Words looked up since then are
+        marked as seen, which only reads the recent part of the history.
+        """
+        annotation = Annotation.query.get(text.id)
+        key = self.annotationKey()
+        if annotation is None or key != (annotation.language, annotation.freq_source,
+                                         annotation.lemfreq, annotation.freq_hash):
+            return self.annotate(text)
+        language = key[0]
+        now = time.time()
+        # Lookups reach the database up to a flush interval after they happen;
+        # going back that far again is harmless since marking words is idempotent
+        rec = self.parent.rec
+        seen = rec.getLookedUp(language, since=annotation.created - rec.FLUSH_INTERVAL)
+        if seen:
+            seen_lemmas = set(lemmatize_many(list(seen), code[language]))
+            annotations = json.loads(annotation.data)
+            for word, item in annotations.items():
+                if not item[2] and (word in seen or item[0] in seen_lemmas):
+                    item[2] = 1
+            annotation.data = json.dumps(annotations, ensure_ascii=False, separators=(",", ":"))
+            annotation.created = now
+            db.session.commit()
+        return annotation
+
+    def addText(self, text):
+        "Store a new text with its chapters and annotate it"
+        db.session.add(text)
+        db.session.flush()
+        add_chapters(text)
+        db.session.commit()
+        try:
+            self.annotate(text)
+        except Exception:
+            # The annotation is made again when the text is opened
+            logger.exception("Could not annotate %s", text)
+            db.session.rollback()
+
+    def ingest(self, book):
+        "Save a book parsed by an ingest job, returning the new text's id"
+        with app.app_context():
+            text = make_text(book)
+            self.addText(text)
+            return text.id
+
     def start_api(self):
         """ Main server application """
-        
+        self.jobs = JobQueue(self.ingest)
+        if fts:
+            threading.Thread(target=index_library, name="reader-index", daemon=True).start()
+
         @app.route("/home")
         @app.route("/")
         def home():
-            texts = Text.query.all()
-            return render_template('home.html', texts=texts)
+            # The list only needs metadata, not the content of every book
+            texts = Text.query.options(defer(Text.content)).all()
+            jobs = [job.asdict() for job in self.jobs.list() if job.status != "done"]
+            return render_template('home.html', texts=texts, jobs=jobs)
+
+        @app.route("/search")
+        def search_library():
+            if not fts:
+                return jsonify({"error": "Search is not available"}), 503
+            limit = min(request.args.get("limit", SEARCH_LIMIT, type=int), 100)
+            try:
+                return jsonify(search(request.args.get("q", ""), limit))
+            except OperationalError as e:
+                return jsonify({"error": str(e.orig)}), 400
+
+        @app.route("/jobs")
+        def jobs():
+            return jsonify([job.asdict() for job in self.jobs.list()])
+
+        @app.route("/jobs/<int:id>")
+        def job_status(id):
+            job = self.jobs.get(id)
+            if job is None:
+                abort(404)
+            return jsonify(job.asdict())
 
         @app.route("/read/<int:id>")
         def read(id):
-            text = Text.query.get(id)
-            return render_template("page.html", text=text)
+            """ The reader page, opened at the saved position or at the
+            chapter and position given in the query string """
+            text = Text.query.options(defer(Text.content)).get_or_404(id)
+            chapters = get_chapters(id)
+            if text.chapter == text.position == 0 and text.progress > 0:
+                resume_position(text, chapters)
+            chapters = [chapter.asdict() for chapter in chapters]
+            chapter = request.args.get("chapter", text.chapter, type=int)
+            position = request.args.get("position", text.position if chapter == text.chapter else 0, type=int)
+            return render_template("page.html", text=text, chapters=chapters,
+                                   chapter=chapter, position=position)
+
+        @app.route("/read/<int:id>/chapter/<int:number>")
+        def read_chapter(id, number):
+            """ One chapter of a text, as HTML to insert into the page.
+            Only the chapter's part of the content is read from the database. """
+            chapter = Chapter.query.get((id, number))
+            if chapter is None:
+                abort(404)
+            body = db.session.query(db.func.substr(Text.content, chapter.start + 1, chapter.end - chapter.start)) \
+                .filter(Text.id == id).scalar()
+            return render_template("chapter.html", chapter=chapter, lines=chapter_lines(body))
+
+        @app.route("/annotations/<int:id>")
+        def annotations(id):
+            # The content is only loaded if the text has to be annotated again
+            text = Text.query.options(defer(Text.content)).get_or_404(id)
+            annotation = self.getAnnotation(text)
+            # The words are already serialized, so they are spliced in as is
+            head = json.dumps({"language": annotation.language, "freq_source": annotation.freq_source,
+                               "lemfreq": annotation.lemfreq}, ensure_ascii=False)
+            return Response(head[:-1] + ',"words":' + annotation.data + "}", mimetype="application/json")
 
         @app.route("/update/<int:id>", methods=['POST'])
         def update_progress(id):
+            if request.form and request.form.get('chapter'):
+                text = Text.query.options(defer(Text.content)).get_or_404(id)
+                chapter = Chapter.query.get((id, int(request.form.get('chapter'))))
+                if chapter is None:
+                    return "bad"
+                position = min(max(int(request.form.get('position', 0)), 0), chapter.end - chapter.start)
+                total = db.session.query(db.func.max(Chapter.end)).filter(Chapter.text_id == id).scalar()
+                text.chapter = chapter.number
+                text.position = position
+                # overall progress in millionths, as shown on the home page
+                text.progress = (chapter.start + position) * 1_000_000 // max(total, 1)
+                db.session.commit()
+                return "ok"
             if request.form and request.form.get('progress'):
                 # keep values between 0 and 1 million
                 prog = min(int(float(request.form.get('progress'))), 1_000_000)
                 prog = max(prog, 0)
-                text = Text.query.get(id)
+                text = Text.query.options(defer(Text.content)).get_or_404(id)
                 text.progress = int(prog)
                 db.session.commit()
                 return "ok"
@@ -77,11 +465,9 @@ class ReaderServer(QObject):
                 # check if the post request has the file part
                 if 'file' not in request.files:
                     if request.form.get('title') and request.form.get('text'):
-                        new_item = Text(title=request.form.get('title'),
-                                        content="######\n" + request.form.get('text'),
-                                        length=len(re.findall(r'\w+', request.form.get('text'))))
-                        db.session.add(new_item)
-                        db.session.commit()
+                        chapters = split_txt_chapters(request.form.get('text').splitlines())
+                        self.addText(make_text({"title": request.form.get('title'), "author": None,
+                                                "chapters": chapters}))
                         return redirect(url_for('home'))
                     else:
                         return redirect(request.url)
@@ -95,7 +481,11 @@ class ReaderServer(QObject):
                 if file and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
                     file.save(fpath:=os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                    add_book(parseBook(fpath))
+                    # Parsing a large book takes a while, so it is done in the background
+                    job = self.jobs.submit(fpath)
+                    if request.accept_mimetypes.best == "application/json":
+                        return jsonify(job.asdict()), 202, {"Location": url_for('job_status', id=job.id)}
+                    flash(f"Importing {filename}")
                     return redirect(url_for('home'))
                 else:
                     flash('Extension not allowed.')
@@ -103,11 +493,24 @@ class ReaderServer(QObject):
 
         @app.route("/delete/<int:id>", methods=['DELETE'])
         def delete(id):
+            Annotation.query.filter_by(text_id=id).delete()
+            Chapter.query.filter_by(text_id=id).delete()
+            unindex_text(id)
             Text.query.filter_by(id=id).delete()
             db.session.commit()
             return ('', 204)
 
-        app.run(debug=False, use_reloader=False,host=self.host, port=self.port)
+        try:
+            self.server = HTTPServer(app, self.host, self.port, **self.options)
+        except OSError:
+            return
+        self.server.serve()
+
+    def stop(self):
+        if self.jobs:
+            self.jobs.close()
+        if self.server:
+            self.server.shutdown()
 
 
 
@@ -116,14 +519,18 @@ class ReaderServer(QObject):
 
 
 
-def add_book(book_obj):
+def count_words(s):
+    "Number of words in a string, without building a list of them"
+    return sum(1 for _ in re.finditer(r'\w+', s))
+
+def make_text(book_obj):
+    """ A new text from a parsed book. Its length is the sum of the word
+    counts of its chapters, set by add_chapters(). """
     chapters = "\n\n\n\n".join(book_obj['chapters'])
-    new_item = Text(title=book_obj['title'],
-                    author=book_obj['author'],
-                    content=chapters,
-                    length=len(re.findall(r'\w+', chapters)))
-    db.session.add(new_item)
-    db.session.commit()
+    return Text(title=book_obj['title'],
+                author=book_obj['author'],
+                content=chapters,
+                length=0)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -2,33 +2,90 @@ import ebooklib
 from ebooklib import epub
 from charset_normalizer import from_bytes
 from lxml import etree
+import codecs
+import re
 import os
 
+# Bytes of a document looked at to detect its encoding
+SAMPLE_SIZE = 65536
+# A line after a blank line is taken as a chapter heading in plain text if
+# it is at most HEADING_MAX characters and looks like "Chapter 12",
+# "CHAPTER ONE: The Beginning", "Prologue", "XIV" or "3."
+HEADING_MAX = 80
+TXT_HEADING = re.compile(r"""
+    (?:chapter|part|book|prologue|epilogue|interlude|kapitel|teil|chapitre|partie|
+       capítulo|parte|capitolo|hoofdstuk|rozdział|глава|часть|книга|пролог|эпилог)
+    (?:\s+\w+)?                   # number, roman numeral or number word
+    \.?(?:\s*[.:\-–—]\s*.*)?       # title after a separator
+    | (?-i:[IVXLCDM]+)\.?
+    | \d{1,4}\.?
+""", re.I | re.X)
+# Longer chapters are split at the next blank line, so that the reader
+# never has to load a huge chapter at once
+CHAPTER_MAX = 200000
+# EPUB files with fewer documents are parsed in this process, as sending
+# them to a process pool costs more than it saves
+POOL_MIN_DOCUMENTS = 8
+
 remove_ns = lambda s: str(s).split("}")[-1]
-tostr = lambda s: str(from_bytes(etree.tostring(s, encoding='utf8', method='text')).best()).strip()
-tohtml = lambda s: str(from_bytes(etree.tostring(s, encoding='utf8')).best()).strip()
+# lxml has already decoded the document, so text is extracted as str directly
+tostr = lambda s: etree.tostring(s, encoding='unicode', method='text').strip()
+tohtml = lambda s: etree.tostring(s, encoding='unicode').strip()
+
+
+def detect_encoding(data: bytes):
+    """
+    Encoding of an XML document that lxml cannot work out by itself, from a
+    sample of its beginning. None if the document has a byte order mark or
+    an encoding declaration, or is valid UTF-8.
+    """
+    if data.startswith((codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)) \
+            or re.match(rb'\s*<\?xml[^>]*encoding=', data):
+        return None
+    try:
+        # An incremental decoder accepts a sample that ends mid-character
+        codecs.getincrementaldecoder("utf-8")().decode(data[:SAMPLE_SIZE])
+        return None
+    except UnicodeDecodeError:
+        best = from_bytes(data[:SAMPLE_SIZE]).best()
+        return best.encoding if best else None
+
+def parse_xml(data: bytes):
+    "Parse a document, detecting its encoding once if it does not declare one"
+    try:
+        return etree.fromstring(data, etree.XMLParser(encoding=detect_encoding(data)))
+    except etree.XMLSyntaxError as e:
+        # lxml errors cannot be sent back from worker processes
+        raise ValueError(f"Invalid document: {e}") from None
 
+def parseEpubDocument(content: bytes):
+    "A chapter in the ###### format from an EPUB document, None if it has no text"
+    data = tostr(parse_xml(content))
+    if len(data.splitlines()) < 2:
+        return None
+    ch_name = data.splitlines()[0]
+    content = "\n".join(data.splitlines()[1:])
+    return f"######{ch_name}\n" + content
 
-def parseEpub(path):
+def parseEpub(path, pool=None):
+    """
+    Parse an EPUB file. Its documents are parsed in parallel if a process
+    pool is given and there are at least POOL_MIN_DOCUMENTS of them.
+    """
     book = epub.read_epub(path)
     title = book.get_metadata('DC', 'title') or ""
     author = book.get_metadata('DC', 'creator') or ""
-    chapters = []
-    for doc in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-        tree = etree.fromstring(doc.get_content())
-        notags = etree.tostring(tree, encoding='utf8', method='text')
-        data = str(from_bytes(notags).best()).strip()
-        if len(data.splitlines()) < 2:
-            continue
-        ch_name = data.splitlines()[0]
-        content = "\n".join(data.splitlines()[1:])
-        chapters.append(f"######{ch_name}\n"+content)
+    documents = [doc.get_content() for doc in book.get_items_of_type(ebooklib.ITEM_DOCUMENT)]
+    if pool is not None and len(documents) >= POOL_MIN_DOCUMENTS:
+        parsed = pool.map(parseEpubDocument, documents, chunksize=max(1, len(documents) // 32))
+    else:
+        parsed = map(parseEpubDocument, documents)
+    chapters = [chapter for chapter in parsed if chapter is not None]
     return {"title": title[0][0], "author": author[0][0], "chapters": chapters}
 
 def parseFb2(path):
     with open(path, 'rb') as f:
-        data = bytes(f.read())
-        tree = etree.fromstring(data)
+        tree = parse_xml(f.read())
     chapters = [] 
     already_seen = False
     authors = []
@@ -59,13 +116,71 @@ def parseFb2(path):
         "chapters": chapters
     }
 
-def parseBook(path):
+def txt_encoding(path):
+    "Encoding of a text file, detected from a sample of its beginning"
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    return detect_encoding(sample) or "utf-8"
+
+def split_txt_chapters(lines):
+    """
+    Chapters in the ###### format from lines of plain text, one chapter at
+    a time. Headings are recognized with TXT_HEADING. Text before the first
+    heading becomes an untitled chapter.
+    """
+    heading, title, body, size, part = "", "", [], 0, 1
+    blank = True
+    for line in lines:
+        line = line.rstrip()
+        stripped = line.strip()
+        if blank and stripped and len(stripped) <= HEADING_MAX and TXT_HEADING.fullmatch(stripped):
+            if title or size:
+                yield f"######{title}\n" + "\n".join(body).rstrip("\n")
+            heading = title = stripped
+            body, size, part = [], 0, 1
+        elif not stripped and size > CHAPTER_MAX:
+            yield f"######{title}\n" + "\n".join(body).rstrip("\n")
+            part += 1
+            title = f"{heading} ({part})".strip()
+            body, size = [], 0
+        elif body or stripped:
+            body.append(line)
+            size += len(line) + 1
+        blank = not stripped
+    if title or size:
+        yield f"######{title}\n" + "\n".join(body).rstrip("\n")
+
+def iterTxt(path, encoding):
+    with open(path, encoding=encoding, errors="replace") as f:
+        yield from split_txt_chapters(f)
+
+def parseTxt(path):
+    """
+    Parse a plain text file. The encoding is detected once from a sample,
+    then the file is decoded as it is read, so chapters are a generator
+    and memory use does not grow with the size of the file.
+    """
+    title = os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+    return {"title": title, "author": "", "chapters": iterTxt(path, txt_encoding(path))}
+
+def parseBook(path, pool=None):
+    """
+    Parse a book file. With a process pool, EPUB documents are parsed in
+    parallel and FB2 files in one of the pool's processes. Text files are
+    read in this process, as they are streamed.
+    """
     if os.path.splitext(path)[1] == ".epub":
-        return parseEpub(path)
-    elif os.path.splitext(path)[1] == ".fb2":
-        return parseFb2(path)
+        return parseEpub(path, pool)
     elif os.path.splitext(path)[1] == ".txt":
         return parseTxt(path)
+    elif pool is not None:
+        return pool.submit(parseBook, path).result()
+    elif os.path.splitext(path)[1] == ".fb2":
+        return parseFb2(path)
     else:
         raise Exception("Filetype unknown")
 
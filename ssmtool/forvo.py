@@ -1,5 +1,5 @@
 import bs4
-import requests
+from . import net
 from playsound import PlaysoundException, playsound
 from os import path
 import re
@@ -13,7 +13,7 @@ Path(path.join(datapath, "forvo")).mkdir(parents=True, exist_ok=True)
 
 def get_forvo_url(word, lang):
     url = "https://forvo.com/word/%s/" % word
-    html = bs4.BeautifulSoup(requests.get(url, headers=HEADERS, timeout=3).text, "lxml")
+    html = bs4.BeautifulSoup(net.get(url, headers=HEADERS, timeout=3).text, "lxml")
     available_langs_el = html.find_all(id=re.compile(r"language-container-\w{2,4}"))
     available_langs = [re.findall(r"language-container-(\w{2,4})", el.attrs["id"])[0] for el in available_langs_el]
     lang_container = [l for l in available_langs_el if
@@ -49,12 +49,12 @@ def get_forvo_url(word, lang):
     
 
 def dl_file(url, fname):
-    r = requests.get(url, headers=HEADERS, timeout=3)
-    f = open(fname, 'wb')
-    for chunk in r.iter_content(chunk_size=512 * 1024): 
-        if chunk: # filter out keep-alive new chunks
-            f.write(chunk)
-    f.close()
+    with net.get(url, headers=HEADERS, timeout=3, stream=True) as r:
+        f = open(fname, 'wb')
+        for chunk in r.iter_content(chunk_size=512 * 1024): 
+            if chunk: # filter out keep-alive new chunks
+                f.write(chunk)
+        f.close()
     return 
 
 def play_forvo(word, lang):
@@ -0,0 +1,148 @@
+"""
+Lemmatization with cached language data. pymorphy2 is used for Russian
+and simplemma for the other supported languages; each is only imported
+when a language needs it. simplemma models are
+loaded at most once while they stay among the `models` most recently used
+languages, and the pymorphy2 analyzer is only created when first needed.
+Lemmas of individual words are memoized.
+"""
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from .cache import LRUCache
+
+simplemma_languages = ['bg', 'ca', 'cy', 'da', 'de', 'en', 'es', 'et', 'fa', 'fi', 'fr',
+                       'ga', 'gd', 'gl', 'gv', 'hu', 'id', 'it', 'ka', 'la', 'lb', 'lt',
+                       'lv', 'nl', 'pt', 'ro', 'ru', 'sk', 'sl', 'sv', 'tr', 'uk', 'ur']
+# Inputs with fewer new words than this are not worth sending to other processes
+PROCESS_MIN = 100000
+PROCESS_CHUNK = 20000
+logger = logging.getLogger(__name__)
+process_pool = None
+worker = None
+
+
+def lemmatize_chunk(words, language):
+    "Lemmatize words in a worker process, which keeps its own Lemmatizer"
+    global worker
+    if worker is None:
+        worker = Lemmatizer(memo=0)
+    return [worker.lemmatizeUncached(word, language) for word in words]
+
+
+class Lemmatizer():
+    def __init__(self, models=3, memo=100000):
+        self.maxmodels = models
+        self.models = OrderedDict()
+        self.morph = None
+        self.lock = threading.Lock()
+        # One lock per language, so a model is never loaded twice at once
+        self.loading = defaultdict(threading.Lock)
+        self.memo = LRUCache(maxitems=memo)
+        self.load_times = {}
+
+    def model(self, language):
+        "simplemma data for a language, loading it if needed"
+        with self.lock:
+            if language in self.models:
+                self.models.move_to_end(language)
+                return self.models[language]
+        with self.loading[language]:
+            with self.lock:
+                if language in self.models:
+                    return self.models[language]
+            start = time.perf_counter()
+            import simplemma
+            data = simplemma.load_data(language)
+            self.loaded(language, start)
+            with self.lock:
+                self.models[language] = data
+                while len(self.models) > self.maxmodels:
+                    self.models.popitem(last=False)
+            return data
+
+    def analyzer(self):
+        "The pymorphy2 analyzer for Russian, created on first use"
+        with self.loading['ru']:
+            if self.morph is None:
+                start = time.perf_counter()
+                import pymorphy2
+                try:
+                    self.morph = pymorphy2.MorphAnalyzer(lang="ru")
+                except ValueError:
+                    self.morph = pymorphy2.MorphAnalyzer(lang="ru-old")
+                self.loaded('ru', start)
+        return self.morph
+
+    def loaded(self, language, start):
+        self.load_times[language] = time.perf_counter() - start
+        logger.info("Loaded lemmatizer for %s in %d ms", language, self.load_times[language] * 1000)
+
+    def lemmatize(self, word, language):
+        key = (language, word)
+        lemma = self.memo.get(key)
+        if lemma is None:
+            lemma = self.lemmatizeUncached(word, language)
+            self.memo.put(key, lemma)
+        return lemma
+
+    def lemmatizeUncached(self, word, language):
+        if language == 'ru':
+            return self.analyzer().parse(word)[0].normal_form
+        elif language in simplemma_languages:
+            import simplemma
+            return simplemma.lemmatize(word, self.model(language))
+        else:
+            return word
+
+    def lemmatizeMany(self, words, language, processes=None):
+        """
+        Lemmas of a list of words, aligned with it. Every distinct word is
+        lemmatized once. If processes is given and there are at least
+        PROCESS_MIN words not memoized yet, they are split over a pool of
+        that many processes.
+        """
+        lemmas = {}
+        todo = []
+        for word in dict.fromkeys(words):
+            lemma = self.memo.get((language, word))
+            if lemma is None:
+                todo.append(word)
+            else:
+                lemmas[word] = lemma
+        if processes and len(todo) >= PROCESS_MIN:
+            chunks = [todo[i:i + PROCESS_CHUNK] for i in range(0, len(todo), PROCESS_CHUNK)]
+            results = self.pool(processes).map(lemmatize_chunk, chunks, [language] * len(chunks))
+            done = [lemma for chunk in results for lemma in chunk]
+        else:
+            done = [self.lemmatizeUncached(word, language) for word in todo]
+        for word, lemma in zip(todo, done):
+            lemmas[word] = lemma
+            self.memo.put((language, word), lemma)
+        return [lemmas[word] for word in words]
+
+    def pool(self, processes):
+        global process_pool
+        with self.lock:
+            if process_pool is None:
+                process_pool = ProcessPoolExecutor(min(processes, os.cpu_count() or 1))
+            return process_pool
+
+    def load(self, language):
+        "Load the data for a language now"
+        if language == 'ru':
+            self.analyzer()
+        elif language in simplemma_languages:
+            self.model(language)
+
+    def stats(self) -> dict:
+        memo = self.memo.stats()
+        return {
+            "models": list(self.models) + (['ru'] if self.morph else []),
+            "load_times": dict(self.load_times),
+            "memo": memo["items"],
+            "hit_rate": memo["hit_rate"],
+        }
@@ -16,10 +16,14 @@ from .forvo import *
 from .tools import *
 from .db import *
 from .dictionary import *
-from .api import LanguageServer
+from .workers import Task, WarmUp
+from .notequeue import NoteWriter
+from . import net
+from . import serving
+from . import startup
 from . import __version__
-from .ext.reader import ReaderServer
-from .ext.importer import KindleImporter
+import logging
+logger = logging.getLogger(__name__)
 
 # If on macOS, display the modifier key as "Cmd", else display it as "Ctrl"
 if platform.system() == "Darwin":
@@ -51,6 +55,15 @@ class GlobalObject(QObject):
 
 
 class DictionaryWindow(QMainWindow):
+    # Lets lookups running outside of the GUI thread report to the status bar
+    status_signal = pyqtSignal(str)
+    # (ticket, source, result) of lookups that missed their deadline
+    late_signal = pyqtSignal(int, str, object)
+    note_queued = pyqtSignal()
+    stats_changed = pyqtSignal()
+    # Milliseconds between showing the window and starting the warm-up
+    WARMUP_DELAY = 500
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Simple Sentence Mining")
@@ -58,12 +71,22 @@ class DictionaryWindow(QMainWindow):
         self.resize(400, 700)
         self.widget = QWidget()
         self.settings = QSettings("FreeLanguageTools", "SimpleSentenceMining")
-        self.rec = Record()
+        self.rec = Record(write_behind=True)
+        definition_cache.resize(self.settings.value("lookup_cache_size", 1000, type=int))
+        set_offline(self.settings.value("offline_mode", False, type=bool))
+        net.configure(timeout=self.settings.value("http_timeout", 4, type=int))
         self.setCentralWidget(self.widget)
         self.previousWord = ""
         self.audio_path = ""
         self.scaleFont()
-        self.forvo_scraping = ""
+        # Ticket of the running Forvo fetch, and the newest word waiting for it to end
+        self.forvo_ticket = None
+        self.forvo_pending = None
+        self.lookup_pool = QThreadPool()
+        self.lookup_pool.setMaxThreadCount(2)
+        self.lookup_ticket = 0
+        self.status_signal.connect(self.status)
+        self.late_signal.connect(self.onLateResult)
         self.initWidgets()
         if self.settings.value("orientation", "Vertical") == "Vertical":
             self.setupWidgetsV()
@@ -72,6 +95,7 @@ class DictionaryWindow(QMainWindow):
         self.setupMenu()
         self.setupButtons()
         self.startServer()
+        self.startNoteWriter()
         self.initTimer()
         self.updateAnkiButtonState()
         self.setupShortcuts()
@@ -277,6 +301,7 @@ class DictionaryWindow(QMainWindow):
         if not fname:
             return
         else:
+            from .ext.importer import KindleImporter
             self.import_kindle = KindleImporter(self, fname)
             self.import_kindle.exec()
 
@@ -308,8 +333,6 @@ class DictionaryWindow(QMainWindow):
         QDesktopServices.openUrl(QUrl(url))
 
     def lookupClicked(self, use_lemmatize=True):
-        if self.forvo_scraping:
-            return
         target = self.getCurrentWord()
         self.updateAnkiButtonState()
         if target == "":
@@ -372,71 +395,195 @@ class DictionaryWindow(QMainWindow):
             self.setSentence(preprocess_clipboard(text, lang))
 
     def lookupSet(self, word, use_lemmatize=True):
+        """
+        Start looking up a word on the thread pool. Only the most recent
+        request is applied when it completes; queued older ones are dropped
+        and results of ones already running are ignored.
+        """
         sentence_text = self.sentence.toPlainText()
         if self.settings.value("bold_word", type=bool) == True:
             sentence_text = sentence_text.replace("_","").replace(word, f"__{word}__")
         self.sentence.setText(sentence_text)
-        QCoreApplication.processEvents()
-        result = self.lookup(word, use_lemmatize)
-        self.setState(result)
-        QCoreApplication.processEvents()
+        self.lookup_ticket += 1
+        self.lookup_pool.clear()
+        task = Task(self.lookup_ticket, self.lookupTask, self.lookup_ticket, word, use_lemmatize)
+        task.signals.result.connect(self.onLookupResult)
+        task.signals.error.connect(self.onLookupError)
+        self.lookup_pool.start(task)
+
+    def lookupTask(self, ticket, word, use_lemmatize):
+        "Runs on the thread pool"
+        late = lambda source, result: self.late_signal.emit(ticket, source, result)
+        item, freq = self.lookupSources(word, use_lemmatize, with_freq=True, late=late)
+        return {"word": word, "item": item, "freq": freq}
+
+    def onLookupResult(self, ticket, result):
+        if ticket != self.lookup_ticket:
+            return
+        item = result['item']
+        self.prev_states.append(self.getState())
+        self.setState(item)
+        if result['freq'] is not None:
+            self.freq_display.display(result['freq'])
+        if item.get('definition2') is None:
+            self.definition2.clear()
+        self.updateAnkiButtonState(is_failed_lookup(item['definition']))
         self.audio_path = None
-        if self.settings.value("forvo", False, type=bool) and not self.forvo_scraping:
-            self.forvo_scraping = True
-            self.audio_path = play_forvo(word, code[self.settings.value("target_language")])
-            self.forvo_scraping = False
+        if self.settings.value("forvo", False, type=bool):
+            self.startForvo(ticket, result['word'])
 
-    def lookup(self, word, use_lemmatize=True, record=True):
+    def startForvo(self, ticket, word):
+        """
+        Fetch the pronunciation of a word. Only one fetch runs at a time:
+        if one is running, the word waits for it to end, replacing any word
+        that was already waiting.
+        """
+        if self.forvo_ticket is not None:
+            self.forvo_pending = (ticket, word)
+            return
+        self.forvo_ticket = ticket
+        task = Task(ticket, play_forvo, word, code[self.settings.value("target_language")])
+        task.signals.result.connect(self.onForvoResult)
+        task.signals.error.connect(self.onForvoError)
+        QThreadPool.globalInstance().start(task)
+
+    def forvoDone(self):
+        self.forvo_ticket = None
+        if self.forvo_pending is not None:
+            ticket, word = self.forvo_pending
+            self.forvo_pending = None
+            if ticket == self.lookup_ticket:
+                self.startForvo(ticket, word)
+
+    def onLateResult(self, ticket, source, result):
+        "Fill in a secondary dictionary or frequency result that missed the deadline"
+        if ticket != self.lookup_ticket or result is None:
+            return
+        if source == "definition2":
+            self.definition2.setText(result['definition'].strip())
+        elif source == "freq":
+            self.freq_display.display(result)
+
+    def onLookupError(self, ticket, error):
+        if ticket == self.lookup_ticket:
+            self.status(error)
+
+    def onForvoResult(self, ticket, audio_path):
+        if ticket == self.lookup_ticket:
+            self.audio_path = audio_path
+        self.forvoDone()
+
+    def onForvoError(self, ticket, error):
+        self.forvoDone()
+
+    def lookupFreq(self, word):
+        "Rank of the word in the selected frequency list, -1 if absent, None if disabled"
+        freqname = self.settings.value("freq_source", "Disabled")
+        if freqname == "Disabled":
+            return None
+        language = code[self.settings.value("target_language", "English")]
+        lemfreq = self.settings.value("lemfreq", True, type=bool)
+        word = re.sub('[«»…,()\[\]]*', "", word)
+        return getFreq(word, language, lemfreq, freqname)
+
+    def lookup(self, word, use_lemmatize=True, record=True, deadline=None):
         """
         Look up a word and return a dict with the lemmatized form (if enabled)
-        and definition
+        and definition. This does not touch any widgets, so it can be called
+        from worker threads and from the API server.
+        """
+        return self.lookupSources(word, use_lemmatize, record, deadline=deadline)[0]
+
+    def lookupSources(self, word, use_lemmatize=True, record=True, with_freq=False, deadline=None, late=None):
+        """
+        Look up a word in both dictionary sources, and in the frequency list
+        if with_freq is set, concurrently. The primary dictionary is always
+        waited for; the others are left out if they take longer than deadline
+        seconds, and late(source, result) is called when they finish.
+        Returns (item, frequency).
         """
         TL = self.settings.value("target_language", "English")
-        self.prev_states.append(self.getState())
         lemmatize = use_lemmatize and self.settings.value("lemmatization", True, type=bool)
-        lemfreq = self.settings.value("lemfreq", True, type=bool)
         short_sign = "Y" if lemmatize else "N"
         language = code[TL] #This is in two letter code
         gtrans_lang = self.settings.value("gtrans_lang", "English")
         dictname = self.settings.value("dict_source", "Wiktionary (English)")
+        dict2name = self.settings.value("dict_source2", "Disabled")
         freqname = self.settings.value("freq_source", "Disabled")
+        if deadline is None:
+            deadline = self.settings.value("lookup_deadline", 2.0, type=float)
         word = re.sub('[«»…,()\[\]]*', "", word)
-        if freqname != "Disabled":
-            try:
-                freq = getFreq(word, language, lemfreq, freqname)
-            except TypeError:
-                freq = -1
-            self.freq_display.display(freq)
         if record:
-            self.status(f"L: '{word}' in '{language}', lemma: {short_sign}, from {dictionaries.get(dictname, dictname)}")
-        try:
-            item = lookupin(word, language, lemmatize, dictname, gtrans_lang)
-            if record:
-                self.rec.recordLookup(word, item['definition'], TL, lemmatize, dictionaries.get(dictname, dictname), True)
-        except Exception as e:
+            self.status_signal.emit(f"L: '{word}' in '{language}', lemma: {short_sign}, from {dictionaries.get(dictname, dictname)}")
+
+        jobs = {"definition": (self.lookupSource, (word, TL, lemmatize, dictname, gtrans_lang, record))}
+        names = {"definition": dictionaries.get(dictname, dictname)}
+        if dict2name != "Disabled":
+            jobs["definition2"] = (self.lookupSource, (word, TL, lemmatize, dict2name, gtrans_lang, record))
+            names["definition2"] = dictionaries.get(dict2name, dict2name)
+        if with_freq and freqname != "Disabled":
+            jobs["freq"] = (self.lookupFreq, (word,))
+            names["freq"] = "freq"
+
+        def onLate(source, result, error, seconds):
+            logger.info("Late lookup of '%s' from %s: %d ms", word, names[source], seconds * 1000)
+            if late and error is None:
+                late(source, result)
+
+        results = fanout(jobs, {"definition": None, "definition2": deadline, "freq": deadline}, onLate)
+        latencies = ", ".join(f"{names[source]} {seconds * 1000:.0f} ms"
+                              for source, (_, _, seconds) in results.items())
+        logger.info("Lookup of '%s': %s", word, latencies)
+        if record:
+            self.status_signal.emit(f"'{word}': {latencies}")
+
+        freq = results["freq"][0] if "freq" in results else None
+        item, error, _ = results["definition"]
+        if error is not None:
             if record:
-                self.status(str(e))
-                self.rec.recordLookup(word, None, TL, lemmatize, dictionaries.get(dictname, dictname), False)
-                self.updateAnkiButtonState(True)
+                self.status_signal.emit(str(error))
             item = {
                 "word": word,
                 "definition": failed_lookup(word, self.settings)
                 }
-            return item
-        dict2name = self.settings.value("dict_source2", "Disabled")
-        if dict2name == "Disabled":
-            return item
+            return item, freq
+        if "definition2" not in results:
+            return item, freq
+        item2, error, _ = results["definition2"]
+        if error is not None:
+            self.status_signal.emit("Dict-2 failed" + str(error))
+            return item, freq
+        return {"word": item['word'], 'definition': item['definition'], 'definition2': item2['definition']}, freq
+
+    def lookupMany(self, words, use_lemmatize=True, dictname=None):
+        """
+        Look up a list of words in one dictionary (the primary one by
+        default), yielding (word, item, error) as results become available.
+        Batch lookups are not recorded.
+        """
+        TL = self.settings.value("target_language", "English")
+        lemmatize = use_lemmatize and self.settings.value("lemmatization", True, type=bool)
+        gtrans_lang = self.settings.value("gtrans_lang", "English")
+        dictname = dictname or self.settings.value("dict_source", "Wiktionary (English)")
+        queries = {}
+        for word in words:
+            queries.setdefault(re.sub('[«»…,()\[\]]*', "", word), []).append(word)
+        for word, item, error in lookup_many(queries, code[TL], lemmatize, dictname, gtrans_lang):
+            for query in queries[word]:
+                yield query, item, error
+
+    def lookupSource(self, word, TL, lemmatize, dictname, gtrans_lang, record=True):
+        "Look up a word in one dictionary and record the lookup"
+        source = dictionaries.get(dictname, dictname)
         try:
-            item2 = lookupin(word, language, lemmatize, dict2name, gtrans_lang)
-            if record:
-                self.rec.recordLookup(word, item['definition'], TL, lemmatize, dictionaries.get(dict2name, dict2name), True)
-        except Exception as e:
-            self.status("Dict-2 failed" + str(e))
+            item = lookupin(word, code[TL], lemmatize, dictname, gtrans_lang)
+        except Exception:
             if record:
-                self.rec.recordLookup(word, None, TL, lemmatize, dictionaries.get(dict2name, dict2name), False)
-            self.definition2.clear()
-            return item
-        return {"word": item['word'], 'definition': item['definition'], 'definition2': item2['definition']}
+                self.rec.recordLookup(word, None, TL, lemmatize, source, False)
+            raise
+        if record:
+            self.rec.recordLookup(word, item['definition'], TL, lemmatize, source, True)
+        return item
         
 
     def createNote(self):
@@ -477,25 +624,101 @@ class DictionaryWindow(QMainWindow):
                 ]
             }
 
-        self.status("Adding note")
-        api = self.settings.value("anki_api")
-        try:
-            addNote(api, content)
-            self.rec.recordNote(str(content), True)
-            self.sentence.clear()
-            self.word.clear()
-            self.definition.clear()
-            self.definition2.clear()
-            self.status(f"Note added: '{word}'")
-        except Exception as e:
-            self.rec.recordNote(str(content), False)
-            self.status(f"Failed to add note: {word}")
-            self.errorNoConnection(e)
+        if not self.rec.queueNote(content):
+            self.status(f"Note already queued: '{word}'")
             return
+        self.sentence.clear()
+        self.word.clear()
+        self.definition.clear()
+        self.definition2.clear()
+        self.status(f"Note queued: '{word}'")
+        self.note_queued.emit()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not hasattr(self, "warmup_thread"):
+            # Leave the first paint and the initial events to the GUI first
+            QTimer.singleShot(self.WARMUP_DELAY, self.startWarmUp)
+
+    def warmUpSteps(self):
+        "What the first lookup would otherwise have to load or connect to"
+        language = code[self.settings.value("target_language", "English")]
+        steps = []
+        if self.settings.value("lemmatization", True, type=bool):
+            steps.append(("lemmatizer", lemmatizer.load, (language,)))
+        for key in ["dict_source", "dict_source2", "freq_source"]:
+            name = self.settings.value(key, "Disabled")
+            if name == "Disabled":
+                continue
+            if key == "freq_source":
+                steps.append((f"frequency list '{name}'", get_ranks, (language, name)))
+            elif name not in dictionaries:
+                steps.append((f"dictionary '{name}'", dictdb.warm, (language, name)))
+            elif dictionaries[name] in source_urls:
+                url = source_urls[dictionaries[name]]
+                steps.append((url, net.warm, (url,)))
+        steps.append(("AnkiConnect", getVersion, (self.settings.value("anki_api", "http://localhost:8765"),)))
+        return steps
+
+    def startWarmUp(self):
+        self.warmup_thread = QThread()
+        self.warmup = WarmUp(self.warmUpSteps())
+        self.warmup.moveToThread(self.warmup_thread)
+        self.warmup_thread.started.connect(self.warmup.run)
+        self.warmup.finished.connect(self.onWarmedUp)
+        self.warmup_thread.start(QThread.LowPriority)
+
+    def onWarmedUp(self, seconds):
+        logger.info("Warm-up finished in %d ms", seconds * 1000)
+        self.warmup_thread.quit()
+
+    def startNoteWriter(self):
+        "Notes are queued in records.db and sent to Anki in the background"
+        self.queued_notes = self.rec.countQueued()
+        self.note_thread = QThread()
+        self.note_writer = NoteWriter()
+        self.note_writer.moveToThread(self.note_thread)
+        self.note_thread.started.connect(self.note_writer.start)
+        self.note_queued.connect(self.note_writer.drain)
+        self.note_writer.queue_changed.connect(self.onQueueChanged)
+        self.note_writer.notes_added.connect(self.onNotesAdded)
+        self.note_writer.note_failed.connect(self.onNoteFailed)
+        self.note_writer.unreachable.connect(self.errorNoConnection)
+        self.note_thread.start()
+
+    def onQueueChanged(self, count):
+        self.queued_notes = count
+        self.showStats()
+
+    def onNotesAdded(self, count):
+        self.status(f"{count} note(s) added to Anki")
+        self.showStats()
+
+    def onNoteFailed(self, error):
+        self.status(f"Failed to add note: {error}")
+
+    def closeEvent(self, event):
+        if hasattr(self, "warmup_thread"):
+            self.warmup.cancel()
+            self.warmup_thread.quit()
+            self.warmup_thread.wait(2000)
+        if hasattr(self, "worker"):
+            self.worker.stop()
+            self.thread.quit()
+            self.thread.wait(2000)
+        if hasattr(self, "worker2"):
+            self.worker2.stop()
+            self.thread2.quit()
+            self.thread2.wait(2000)
+        self.note_thread.quit()
+        self.note_thread.wait(2000)
+        self.rec.close()
+        super().closeEvent(event)
 
     def errorNoConnection(self, error):
         """
-        Dialog window sent when something goes wrong in configuration step
+        Dialog window sent when Anki cannot be reached. Queued notes are
+        kept and sent once it can.
         """
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Critical)
@@ -504,19 +727,38 @@ class DictionaryWindow(QMainWindow):
             + "\n\nHints:"
             + "\nAnkiConnect must be running in order to add notes."
             + "\nIf you have AnkiConnect running at an alternative endpoint,"
-            + "\nbe sure to change it in the configuration.")
+            + "\nbe sure to change it in the configuration."
+            + "\n\nQueued notes will be added once Anki can be reached.")
         msg.exec()
 
     def initTimer(self):
+        """
+        Statistics are refreshed whenever a lookup or note is recorded.
+        The timer only catches the change of day.
+        """
         self.showStats()
+        self.rec.addListener(self.stats_changed.emit)
+        self.stats_changed.connect(self.showStats)
         self.timer = QTimer()
         self.timer.timeout.connect(self.showStats)
-        self.timer.start(500)
+        self.timer.start(60 * 1000)
 
     def showStats(self):
         lookups = self.rec.countLookupsToday()
         notes = self.rec.countNotesToday()
-        self.stats_label.setText(f"L:{str(lookups)} N:{str(notes)}")
+        if self.queued_notes:
+            self.stats_label.setText(f"L:{str(lookups)} N:{str(notes)} Q:{self.queued_notes}")
+        else:
+            self.stats_label.setText(f"L:{str(lookups)} N:{str(notes)}")
+        cache = definition_cache.stats()
+        http = net.stats().values()
+        lem = lemmatizer.stats()
+        self.stats_label.setToolTip(f"Lookups today: {lookups}\nNotes today: {notes}\n"
+            f"Notes waiting for Anki: {self.queued_notes}\n"
+            f"Definition cache: {cache['items']} items, {cache['hits']} hits, {cache['misses']} misses\n"
+            f"HTTP: {sum(h['requests'] for h in http)} requests over {sum(h['connections'] for h in http)} connections\n"
+            f"Lemmatizer: {', '.join(f'{lang} ({secs:.1f} s)' for lang, secs in lem['load_times'].items())}, "
+            f"{lem['memo']} words, {lem['hit_rate']:.0%} hits")
 
     def time(self):
         return QDateTime.currentDateTime().toString('[hh:mm:ss]')
@@ -533,10 +775,11 @@ class DictionaryWindow(QMainWindow):
     def startServer(self):
         if self.settings.value("api_enabled", True, type=bool):
             try:
+                from .api import LanguageServer
                 self.thread = QThread()
                 port = self.settings.value("port", 39284, type=int)
                 host = self.settings.value("host", "127.0.0.1")
-                self.worker = LanguageServer(self, host, port)
+                self.worker = LanguageServer(self, host, port, serving.options(self.settings))
                 self.worker.moveToThread(self.thread)
                 self.thread.started.connect(self.worker.start_api)
                 self.worker.note_signal.connect(self.onNoteSignal)
@@ -546,10 +789,12 @@ class DictionaryWindow(QMainWindow):
                 self.status("Failed to start API server")
         if self.settings.value("reader_enabled", True, type=bool):
             try:
+                # Flask-SQLAlchemy and the reader database are only loaded when the reader is enabled
+                from .ext.reader import ReaderServer
                 self.thread2 = QThread()
                 port = self.settings.value("reader_port", 39285, type=int)
                 host = self.settings.value("reader_host", "127.0.0.1")
-                self.worker2 = ReaderServer(self, host, port)
+                self.worker2 = ReaderServer(self, host, port, serving.options(self.settings))
                 self.worker2.moveToThread(self.thread2)
                 self.thread2.started.connect(self.worker2.start_api)
                 self.thread2.start()
@@ -578,7 +823,12 @@ def main():
     app = QApplication(sys.argv)
     app.setApplicationName("ssmtool")
     app.setOrganizationName("FreeLanguageTools")
+    startup.mark("QApplication created")
     w = DictionaryWindow()
+    startup.mark("Main window created")
 
     w.show()
+    startup.mark("Main window shown")
+    # Runs once the event loop has started and the window has been painted
+    QTimer.singleShot(0, startup.finish)
     sys.exit(app.exec())
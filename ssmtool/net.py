@@ -0,0 +1,96 @@
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Defaults for all online sources; can be changed with configure()
+TIMEOUT = 4
+POOL_SIZE = 4
+RETRIES = 2
+BACKOFF = 0.3
+
+sessions = {}
+lock = threading.Lock()
+
+
+def configure(timeout=None, pool_size=None, retries=None, backoff=None):
+    """Change the defaults. Sessions are recreated on next use if the pool
+    or retry policy changed."""
+    global TIMEOUT, POOL_SIZE, RETRIES, BACKOFF
+    TIMEOUT = timeout if timeout is not None else TIMEOUT
+    policy = (POOL_SIZE, RETRIES, BACKOFF)
+    POOL_SIZE = pool_size if pool_size is not None else POOL_SIZE
+    RETRIES = retries if retries is not None else RETRIES
+    BACKOFF = backoff if backoff is not None else BACKOFF
+    if policy != (POOL_SIZE, RETRIES, BACKOFF):
+        with lock:
+            for s in sessions.values():
+                s.close()
+            sessions.clear()
+
+
+def make_session() -> requests.Session:
+    # Connection errors are retried for any method since nothing was sent;
+    # error statuses and read errors only for idempotent requests.
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def session(url) -> requests.Session:
+    "Keep-alive session for the host of url, created on first use"
+    host = urlsplit(url).netloc
+    with lock:
+        if host not in sessions:
+            sessions[host] = make_session()
+        return sessions[host]
+
+
+def get(url, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", TIMEOUT)
+    return session(url).get(url, **kwargs)
+
+
+def post(url, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", TIMEOUT)
+    return session(url).post(url, **kwargs)
+
+
+def warm(url):
+    "Open a keep-alive connection to the host of url ahead of the first request"
+    session(url).head(url, timeout=TIMEOUT, allow_redirects=False).close()
+
+
+def stats() -> dict:
+    "Number of requests sent and connections opened, per host"
+    result = {}
+    with lock:
+        items = list(sessions.items())
+    for host, s in items:
+        n_requests = n_connections = 0
+        adapter = s.get_adapter("https://")
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                n_requests += pool.num_requests
+                n_connections += pool.num_connections
+        result[host] = {
+            "requests": n_requests,
+            "connections": n_connections,
+            "reused": max(n_requests - n_connections, 0),
+        }
+    return result
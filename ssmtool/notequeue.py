@@ -0,0 +1,98 @@
+from PyQt5.QtCore import QObject, QSettings, QTimer, pyqtSignal
+from .db import Record
+from .tools import invoke
+
+
+class NoteWriter(QObject):
+    """
+    Sends notes queued in the outbox of records.db to Anki. Meant to live
+    on its own QThread. Notes are sent in batches with the AnkiConnect
+    `multi` action. While Anki cannot be reached, the queue is kept and
+    retried with exponential backoff. A note rejected by Anki is retried on
+    later batches and dropped after MAX_ATTEMPTS rejections; duplicates are
+    dropped immediately. Failures to reach Anki, and errors Anki gives while
+    its collection is not open yet, do not count as rejections.
+    `unreachable` is emitted once when Anki stops answering, not on every
+    retry.
+    """
+    queue_changed = pyqtSignal(int)
+    notes_added = pyqtSignal(int)
+    note_failed = pyqtSignal(str)
+    unreachable = pyqtSignal(str)
+    BATCH = 25
+    MIN_BACKOFF = 2
+    MAX_BACKOFF = 120
+    MAX_ATTEMPTS = 3
+    IDLE_INTERVAL = 30
+    # Errors of an Anki that is still starting up or syncing
+    TRANSIENT_ERRORS = ["collection is not available"]
+
+    def start(self):
+        "Runs in the writer thread"
+        self.rec = Record()
+        self.settings = QSettings("FreeLanguageTools", "SimpleSentenceMining")
+        self.backoff = self.MIN_BACKOFF
+        self.reachable = True
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.drain)
+        self.drain()
+
+    def drain(self):
+        self.timer.stop()
+        queued = self.rec.getQueued(self.BATCH)
+        if not queued:
+            self.backoff = self.MIN_BACKOFF
+            self.queue_changed.emit(0)
+            self.timer.start(self.IDLE_INTERVAL * 1000)
+            return
+        ids = [id for id, _, _ in queued]
+        api = self.settings.value("anki_api", "http://localhost:8765")
+        try:
+            results = invoke('multi', api, actions=[
+                {"action": "addNote", "params": {"note": note}} for _, note, _ in queued])
+        except Exception as e:
+            # Anki is not running, or AnkiConnect is unreachable
+            self.rec.markAttempt(ids, str(e), rejected=False)
+            if self.reachable:
+                self.reachable = False
+                self.unreachable.emit(str(e))
+            self.queue_changed.emit(self.rec.countQueued())
+            self.timer.start(self.backoff * 1000)
+            self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+            return
+        self.backoff = self.MIN_BACKOFF
+        self.reachable = True
+        done = []
+        added = 0
+        transient = False
+        for (id, note, attempts), res in zip(queued, results):
+            if isinstance(res, dict) and 'error' in res:
+                error = res['error']
+            else:
+                error = None
+            if error is None:
+                self.rec.recordNote(str(note), True)
+                done.append(id)
+                added += 1
+            elif any(message in str(error) for message in self.TRANSIENT_ERRORS):
+                self.rec.markAttempt([id], str(error), rejected=False)
+                transient = True
+            elif "duplicate" in str(error) or attempts + 1 >= self.MAX_ATTEMPTS:
+                self.rec.recordNote(str(note), False)
+                done.append(id)
+                self.note_failed.emit(str(error))
+            else:
+                self.rec.markAttempt([id], str(error))
+        self.rec.dequeueNotes(done)
+        if added:
+            self.notes_added.emit(added)
+        remaining = self.rec.countQueued()
+        self.queue_changed.emit(remaining)
+        if remaining and done and not transient:
+            self.timer.start(0)
+        elif remaining:
+            self.timer.start(self.backoff * 1000)
+            self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+        else:
+            self.timer.start(self.IDLE_INTERVAL * 1000)
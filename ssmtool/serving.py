@@ -0,0 +1,69 @@
+"""
+Embedded HTTP servers for the local API and the web reader. waitress is
+used when it is installed: a fixed pool of worker threads, keep-alive
+connections and no per-request thread creation. Otherwise the apps are
+served by werkzeug (Flask's own server) with a thread per request.
+Either way, shutdown() stops the server cleanly from another thread.
+"""
+import logging
+try:
+    import waitress.server
+except ImportError:
+    waitress = None
+
+BACKENDS = ["waitress", "werkzeug"]
+THREADS = 8
+# Idle keep-alive connections and stalled requests are dropped after this many seconds
+TIMEOUT = 30
+logger = logging.getLogger(__name__)
+
+def available_backends():
+    return BACKENDS if waitress else ["werkzeug"]
+
+def options(settings) -> dict:
+    "Server options from the user settings"
+    return {
+        "backend": settings.value("server_backend", "waitress"),
+        "threads": settings.value("server_threads", THREADS, type=int),
+        "timeout": settings.value("server_timeout", TIMEOUT, type=int),
+    }
+
+class HTTPServer():
+    def __init__(self, app, host, port, backend="waitress", threads=THREADS, timeout=TIMEOUT):
+        if backend == "waitress" and waitress is None:
+            logger.info("waitress is not installed, serving with werkzeug")
+            backend = "werkzeug"
+        self.backend = backend
+        if backend == "waitress":
+            self.server = waitress.server.create_server(
+                app, host=host, port=port, threads=threads,
+                channel_timeout=timeout, ident="ssmtool")
+        else:
+            from werkzeug.serving import make_server, WSGIRequestHandler
+            class RequestHandler(WSGIRequestHandler):
+                # HTTP/1.1 keeps connections alive between requests
+                protocol_version = "HTTP/1.1"
+            RequestHandler.timeout = timeout
+            self.server = make_server(host, port, app, threaded=True, request_handler=RequestHandler)
+
+    def serve(self):
+        "Serve requests until shutdown() is called"
+        if self.backend == "waitress":
+            self.server.run()
+        else:
+            self.server.serve_forever()
+
+    def shutdown(self):
+        if self.backend == "waitress":
+            # Let running requests finish, then close all sockets from the
+            # server's own loop, which ends it
+            self.server.task_dispatcher.shutdown()
+            self.server.trigger.pull_trigger(self.closeChannels)
+        else:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def closeChannels(self):
+        for channel in list(self.server.active_channels.values()):
+            channel.handle_close()
+        self.server.close()
@@ -0,0 +1,118 @@
+"""
+Startup profiling, enabled with --profile-startup. Every module imported
+from then on is timed, like `python -X importtime`, and milestones of the
+startup are recorded with mark(). report() prints the slowest imports and
+the milestones to stderr.
+"""
+import sys
+import time
+import threading
+import importlib.abc
+
+start = time.perf_counter()
+profiler = None
+
+
+class TimedLoader():
+    "Wraps a module loader to time the creation and execution of the module"
+    def __init__(self, loader, profiler):
+        self.loader = loader
+        self.profiler = profiler
+
+    def create_module(self, spec):
+        with self.profiler.timing(spec.name):
+            return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self.profiler.timing(module.__name__):
+            self.loader.exec_module(module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class Timing():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.profiler.stack().append(0.0)
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.profiler.stack()
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        cumulative, own = self.profiler.imports.get(self.name, (0.0, 0.0))
+        self.profiler.imports[self.name] = (cumulative + elapsed, own + elapsed - children)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.imports = {}
+        self.marks = []
+        self.finding = False
+        # Time spent in the imports nested in each import in progress, per thread
+        self.local = threading.local()
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def find_spec(self, name, path, target=None):
+        if self.finding:
+            return None
+        self.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self.finding = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = TimedLoader(spec.loader, self)
+        return spec
+
+    def timing(self, name):
+        return Timing(self, name)
+
+
+def enable():
+    global profiler
+    profiler = ImportProfiler()
+    sys.meta_path.insert(0, profiler)
+
+
+def mark(event):
+    "Record a startup milestone"
+    if profiler:
+        profiler.marks.append((event, time.perf_counter() - start))
+
+
+def finish():
+    "Called when the main window is up"
+    mark("Time to window")
+    report()
+
+
+def report(top=30, file=None):
+    if not profiler:
+        return
+    file = file or sys.stderr
+    imports = sorted(profiler.imports.items(), key=lambda item: -item[1][0])
+    print(f"Startup profile: {len(imports)} modules imported", file=file)
+    print(f"{'self ms':>9} {'total ms':>9}  module", file=file)
+    for name, (cumulative, own) in imports[:top]:
+        print(f"{own * 1000:9.1f} {cumulative * 1000:9.1f}  {name}", file=file)
+    for event, seconds in profiler.marks:
+        print(f"{seconds * 1000:9.1f} ms  {event}", file=file)
+    file.flush()
@@ -1,19 +1,23 @@
 import json
-import urllib.request
-import requests
+from . import net
 import os
 import re
+import glob
+import hashlib
 from bs4 import BeautifulSoup
 from .db import *
 from pystardict import Dictionary
 from .dictionary import *
 
+ANKI_TIMEOUT = 30
+
 def request(action, **params):
     return {'action': action, 'params': params, 'version': 6}
 
 def invoke(action, server, **params):
     requestJson = json.dumps(request(action, **params)).encode('utf-8')
-    response = json.load(urllib.request.urlopen(urllib.request.Request(server, requestJson)))
+    # Adding notes with media can take Anki a while
+    response = net.post(server, data=requestJson, timeout=ANKI_TIMEOUT).json()
     if len(response) != 2:
         raise Exception('response has an unexpected number of fields')
     if 'error' not in response:
@@ -67,6 +71,9 @@ def failed_lookup(word, setting):
             "- Are you connected to the Internet?<br>" +\
             "Otherwise, then " + setting.value("dict_source", "Wiktionary (English)") + " probably just does not have this word listed."
 
+def is_failed_lookup(definition):
+    return definition.startswith("<b>Definition for")
+
 def is_oneword(s):
     return len(s.split()) == 1
 
@@ -91,40 +98,110 @@ def dictinfo(path):
     elif ext == ".ifo":
         return {"type": "stardict", "basename": basename, "path": path}
 
-def dictimport(path, dicttype, lang, name):
-    "Import dictionary from file to database"
-    if dicttype == "stardict":
-        stardict = Dictionary(os.path.splitext(path)[0])
-        newdict = {}
-        for key in stardict.idx.keys():
-            newdict[key] = re.sub('<[^>]*>', '', stardict.dict[key])
-        dictdb.importdict(newdict, lang, name)
-    elif dicttype == "json":
-        with open(path, encoding="utf-8") as f:
-            data = json.load(f)
-            dictdb.importdict(data, lang, name)
-    elif dicttype == "migaku":
-        with open(path, encoding="utf-8") as f:
-            data = json.load(f)
-            d = {}
-            for item in data:
-                d[item['term']] = item['definition']
-            dictdb.importdict(d, lang, name)
-    elif dicttype == "freq":
-        with open(path, encoding="utf-8") as f:
-            data = json.load(f)
-            d = {}
-            for i, word in enumerate(data):
-                d[word] = i+1
-            dictdb.importdict(d, lang, name)
-    else:
+TAGS = re.compile('<[^>]*>')
+
+def stardict_rows(path):
+    stardict = Dictionary(os.path.splitext(path)[0])
+    for key in stardict.idx.keys():
+        yield key, TAGS.sub('', stardict.dict[key])
+
+def json_rows(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    yield from data.items()
+
+# Formats stored as lists may repeat a word. Only its last entry is kept,
+# as the database holds one entry per word and dictionary.
+def migaku_rows(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    yield from {item['term']: item['definition'] for item in data}.items()
+
+def freq_rows(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    yield from {word: i+1 for i, word in enumerate(data)}.items()
+
+dict_readers = {
+    "stardict": stardict_rows,
+    "json": json_rows,
+    "migaku": migaku_rows,
+    "freq": freq_rows,
+}
+
+def dictimport(path, dicttype, lang, name, progress=None, replace=False):
+    """Import dictionary from file to database. Entries are streamed from
+    the file and written in batches; progress(n) is called as they go."""
+    if dicttype not in dict_readers:
         print("Error:", str(dicttype), "is not supported.")
         raise NotImplementedError
+    return dictdb.importdict(dict_readers[dicttype](path), lang, name, progress, replace)
+
+def dictfiles(path, dicttype):
+    "All files a dictionary is read from"
+    if dicttype == "stardict":
+        base = os.path.splitext(path)[0]
+        return sorted(f for f in glob.glob(glob.escape(base) + ".*")
+                      if os.path.splitext(f)[1] in [".ifo", ".idx", ".dict", ".dz", ".gz", ".syn"])
+    return [path]
+
+def dictstat(path, dicttype):
+    "Total size and latest mtime of the dictionary files"
+    files = dictfiles(path, dicttype)
+    return sum(os.path.getsize(f) for f in files), max(os.path.getmtime(f) for f in files)
+
+def dicthash(path, dicttype):
+    h = hashlib.sha1()
+    for fname in dictfiles(path, dicttype):
+        with open(fname, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+    return h.hexdigest()
+
+def dictchanged(item):
+    """Whether a configured dictionary has to be (re)imported. Size and mtime
+    are checked first; the files are only hashed when those differ, so that
+    touched but unmodified files are not reimported."""
+    source = dictdb.getSource(item['lang'], item['name'])
+    if source is None or source['type'] != item['type']:
+        return True
+    size, mtime = dictstat(item['path'], item['type'])
+    if (size, mtime) == (source['size'], source['mtime']):
+        return False
+    digest = dicthash(item['path'], item['type'])
+    if digest != source['hash']:
+        return True
+    dictdb.setSource(item['lang'], item['name'], item['type'], item['path'], size, mtime, digest)
+    return False
+
+def dictadd(item, progress=None):
+    "Import a configured dictionary, replacing any previous copy"
+    size, mtime = dictstat(item['path'], item['type'])
+    digest = dicthash(item['path'], item['type'])
+    count = dictimport(item['path'], item['type'], item['lang'], item['name'], progress, replace=True)
+    dictdb.setSource(item['lang'], item['name'], item['type'], item['path'], size, mtime, digest)
+    invalidate_dictionary(item['lang'], item['name'])
+    return count
+
+def dictremove(item):
+    dictdb.deleteDict(item['lang'], item['name'])
+    invalidate_dictionary(item['lang'], item['name'])
 
-def dictrebuild(dicts):
-    dictdb.purge()
+def dictrebuild(dicts, progress=None):
+    """Bring the database in line with the configured dictionaries: drop the
+    ones no longer configured and reimport only those whose files changed.
+    Returns the names of reimported dictionaries."""
+    configured = [(item['lang'], item['name']) for item in dicts]
+    for lang, name in dictdb.getDicts():
+        if (lang, name) not in configured:
+            dictdb.deleteDict(lang, name)
+            invalidate_dictionary(lang, name)
+    reimported = []
     for item in dicts:
         try:
-            dictimport(item['path'], item['type'], item['lang'], item['name'])
+            if dictchanged(item):
+                dictadd(item, progress)
+                reimported.append(item['name'])
         except Exception as e:
-            print(e)
\ No newline at end of file
+            print(e)
+    return reimported
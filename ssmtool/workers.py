@@ -0,0 +1,68 @@
+import time
+import logging
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSignals(QObject):
+    result = pyqtSignal(int, object)
+    error = pyqtSignal(int, str)
+
+
+class Task(QRunnable):
+    """
+    Runs fn(*args, **kwargs) on a QThreadPool and delivers the outcome
+    through signals. Every task carries a ticket, so that receivers can
+    ignore results of requests that have been superseded in the meantime.
+    """
+    def __init__(self, ticket, fn, *args, **kwargs):
+        super().__init__()
+        self.ticket = ticket
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit(self.ticket, str(e))
+            return
+        self.signals.result.emit(self.ticket, result)
+
+
+class WarmUp(QObject):
+    """
+    Runs a list of (name, fn, args) steps one after another in a thread of
+    its own, reporting how long each took. cancel() stops it before the
+    next step.
+    """
+    step_done = pyqtSignal(str, float)
+    finished = pyqtSignal(float)
+
+    def __init__(self, steps):
+        super().__init__()
+        self.steps = steps
+        self.cancelled = False
+
+    def run(self):
+        start = time.perf_counter()
+        for name, fn, args in self.steps:
+            if self.cancelled:
+                logger.info("Warm-up cancelled")
+                return
+            step_start = time.perf_counter()
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.info("Warm-up of %s failed: %s", name, e)
+                continue
+            seconds = time.perf_counter() - step_start
+            logger.info("Warmed up %s in %d ms", name, seconds * 1000)
+            self.step_done.emit(name, seconds)
+        self.finished.emit(time.perf_counter() - start)
+
+    def cancel(self):
+        self.cancelled = True